@@ -4,6 +4,10 @@ from datetime import date, datetime, timedelta
 from auth import get_current_user
 from database import get_database
 from locked_in import update_locked_in_status
+from chat_log_writer import chat_log_writer
+from chat_storage import insert_chat_logs
+from user_repository import PROGRESS, find_and_update_user, update_user, encode_day
+from streaks import checkin_filter
 
 # Import your rule engine components
 from rule_engine.nlp_preprocessing import NLPPreprocessor
@@ -83,10 +87,7 @@ async def chat_with_sensei(request: ChatRequest,
         if user["mode"] == "locked_in" and user.get("penalty_remaining", 0) > 0:
             new_penalty = user["penalty_remaining"] - 1
 
-            await db.users.update_one(
-                {"_id": current_user["_id"]},
-                {"$set": {"penalty_remaining": new_penalty}}
-            )
+            await update_user(db, current_user, {"$set": {"penalty_remaining": new_penalty}})
 
             response += f"\n\n⚡ Locked-In Progress: {new_penalty} problems left for today."
 
@@ -115,25 +116,20 @@ async def chat_with_sensei(request: ChatRequest,
 
 async def update_streak(db, current_user):
     """Increase streak only once per day"""
-    user = await db.users.find_one({"_id": current_user["_id"]})
+    today = date.today()
 
-    today = date.today().isoformat()
-    last_active = user.get("last_active_date")
-
-    # Only update if user hasn't checked in today
-    if last_active != today:
-        new_streak = user.get("streak", 0) + 1
-
-        await db.users.update_one(
-            {"_id": current_user["_id"]}, 
-            {
-                "$set": {
-                    "streak": new_streak,
-                    "last_active_date": today
-                }
-            }
-        )
-        print(f"Updated streak to {new_streak} for user {current_user['name']}")
+    # Only update if user hasn't checked in today (checked by the filter, no read first)
+    user = await find_and_update_user(
+        db, current_user,
+        {
+            "$inc": {"streak": 1},
+            "$set": {"last_active_date": encode_day(today)}
+        },
+        PROGRESS,
+        query=checkin_filter(today)
+    )
+    if user:
+        print(f"Updated streak to {user['streak']} for user {current_user['name']}")
 
 
 async def add_xp_anytime(db, current_user, difficulty):
@@ -147,12 +143,11 @@ async def add_xp_anytime(db, current_user, difficulty):
 
     xp_gain = xp_values.get(difficulty, 10)
 
-    await db.users.update_one(
-        {"_id": current_user["_id"]},
+    await update_user(
+        db, current_user,
         {
-            
             "$inc": {"xp": xp_gain},
-            "$set": {"last_coding_date": date.today().isoformat()}
+            "$set": {"last_coding_date": encode_day(date.today())}
         }
     )
     print(f"Awarded {xp_gain} XP to user {current_user['name']} for {difficulty} activity.")
@@ -160,9 +155,15 @@ async def add_xp_anytime(db, current_user, difficulty):
 
 
 async def save_chat_message(db, user_id, role, message):
-    await db.chat_logs.insert_one({
+    """Queue a chat message on the write-behind writer (direct insert if it isn't running)"""
+    doc = {
         "user_id": user_id,
         "role": role,  # "user" or "assistant"
         "message": message,
         "timestamp": datetime.utcnow()
-    })
+    }
+
+    if chat_log_writer.running:
+        await chat_log_writer.enqueue(doc)
+    else:
+        await insert_chat_logs(db, [doc])
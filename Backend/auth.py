@@ -1,11 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.responses import StreamingResponse
 from jose import JWTError, jwt
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timedelta, date
 from database import get_database
-from schemas import UserCreate, UserLogin, UserResponse, Token
-from utils import verify_password, get_password_hash, create_access_token, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
-from locked_in import update_locked_in_status
+from schemas import UserCreate, UserLogin, UserResponse, Token, RefreshRequest, ChatHistoryPage
+from utils import verify_and_update_password_async, get_password_hash_async, PasswordHashingBusy, create_access_token, access_token_data, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, USER_CLAIMS_VERSION
+from locked_in import update_locked_in_status, locked_in_evaluation_stages
+from user_cache import user_cache
+from user_repository import (
+    AUTH, PROFILE, PROGRESS, CONTEXT,
+    find_user_by_email, list_users, insert_user, update_user, find_and_update_user,
+    encode_day, stored_day
+)
+from token_cache import token_cache
+from refresh_tokens import create_refresh_token, decode_refresh_token, revocation_filter
+from rate_limit import limit_login, limit_register
+from chat_storage import read_chat_logs, read_chat_history, iter_chat_logs, CHAT_HISTORY_PAGE_SIZE, CHAT_HISTORY_MAX_PAGE_SIZE
+from chat_export import ndjson_stream
 import os
 
 
@@ -19,10 +32,20 @@ router = APIRouter(
 # OAuth2 scheme - token will be taken from Authorization header
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+DAILY_LOGIN_XP = 20
+
 # ============================================
 # HELPER FUNCTIONS
 # ============================================
 
+def hashing_busy_exception() -> HTTPException:
+    """503 returned when the bcrypt pool is saturated"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many login attempts right now, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
 async def authenticate_user(email: str, password: str, db) -> dict | bool:
     """
     Authenticate a user by email and password
@@ -35,16 +58,64 @@ async def authenticate_user(email: str, password: str, db) -> dict | bool:
     Returns:
         dict: User document if authenticated, False otherwise
     """
-    user = await db.users.find_one({"email": email})
+    user = await find_user_by_email(db, email, AUTH)
     
     if not user:
         return False
     
-    if not verify_password(password, user["hashed_password"]):
+    try:
+        valid, new_hash = await verify_and_update_password_async(password, user["hashed_password"])
+    except PasswordHashingBusy:
+        raise hashing_busy_exception()
+
+    if not valid:
         return False
+
+    # Stored hash uses an old cost factor, swap it for one at BCRYPT_ROUNDS
+    if new_hash:
+        await update_user(
+            db, user,
+            {"$set": {"hashed_password": new_hash}},
+            query={"hashed_password": user["hashed_password"]}
+        )
+        user["hashed_password"] = new_hash
+        print(f"Rehashed password for {email} with the current bcrypt cost")
     
     return user
 
+def credentials_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def decode_access_token(token: str) -> dict:
+    """
+    Verify a JWT access token and return its payload
+
+    Tokens seen before (and not yet expired) come from the verified-token
+    cache, skipping the HMAC check and JSON parsing.
+
+    Raises:
+        HTTPException: If the token is invalid or has no subject
+    """
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception()
+
+    # Refresh tokens only work on /auth/refresh, never as bearer tokens
+    if payload.get("sub") is None or payload.get("type") == "refresh":
+        raise credentials_exception()
+
+    token_cache.set(token, payload)
+    return payload
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db = Depends(get_database)
@@ -62,37 +133,51 @@ async def get_current_user(
     Raises:
         HTTPException: If token is invalid or user not found
     """
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    try:
-        # Decode JWT token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        
-        if email is None:
-            raise credentials_exception
-            
-    except JWTError:
-        raise credentials_exception
+    payload = decode_access_token(token)
+    email: str = payload["sub"]
     
-    # Get user from database
-    user = await db.users.find_one({"email": email})
+    # Get user from the per-process cache, falling back to the database
+    user = user_cache.get(email)
+    if user is not None:
+        return user
+
+    user = await find_user_by_email(db, email, CONTEXT)
     
     if user is None:
-        raise credentials_exception
+        raise credentials_exception()
     
+    user_cache.set(email, user)
     return user
 
+async def get_current_user_claims(
+    token: str = Depends(oauth2_scheme),
+    db = Depends(get_database)
+) -> dict:
+    """
+    Lightweight current user built from the token's claims (no DB read)
+
+    Only has _id, name and email. Tokens issued without claims, or with an
+    older claims version, fall back to get_current_user. Routes that need
+    fresh progress/mode state should depend on get_current_user instead.
+    """
+    payload = decode_access_token(token)
+    claims = payload.get("usr")
+
+    if not claims or claims.get("v") != USER_CLAIMS_VERSION:
+        return await get_current_user(token, db)
+
+    return {
+        "_id": claims["id"],
+        "name": claims["name"],
+        "email": claims["email"],
+    }
+
 # ============================================
 # ROUTES
 # ============================================
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def register_user(user: UserCreate, db = Depends(get_database)):
+async def register_user(user: UserCreate, request: Request, db = Depends(get_database)):
     """
     Register a new user
     
@@ -100,15 +185,8 @@ async def register_user(user: UserCreate, db = Depends(get_database)):
     - **email**: User's email address (must be unique)
     - **password**: User's password (minimum 6 characters)
     """
+    await limit_register(request, db)
     print(f"Connected to database: {db.name}")
-    # Check if user already exists
-    existing_user = await db.users.find_one({"email": user.email})
-    if existing_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Email already registered {db.name} database"
-
-        )
     
     # Hash the password
     try:
@@ -117,8 +195,12 @@ async def register_user(user: UserCreate, db = Depends(get_database)):
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Password too long (max 72 characters)"
             )
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await get_password_hash_async(user.password)
         print(hashed_password)
+    except HTTPException:
+        raise
+    except PasswordHashingBusy:
+        raise hashing_busy_exception()
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -132,7 +214,7 @@ async def register_user(user: UserCreate, db = Depends(get_database)):
         "name": user.name,
         "email": user.email,
         "hashed_password": hashed_password,
-        "created_at": datetime.utcnow().isoformat(),
+        "created_at": datetime.utcnow(),
 
         "streak": 0,
         "xp": 0,
@@ -160,27 +242,32 @@ async def register_user(user: UserCreate, db = Depends(get_database)):
     }
     
     
-    # Insert into database
-    result = await db.users.insert_one(user_doc)
-    
-    # Get the created user
-    created_user = await db.users.find_one({"_id": result.inserted_id})
+    # Insert into database, the unique index rejects duplicates (no racy pre-check)
+    try:
+        await insert_user(db, user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Email already registered {db.name} database"
+        )
     
+    # Build the response from the document we just wrote, no read-back
     return UserResponse(
-        id=created_user["_id"],
-        name=created_user["name"],
-        email=created_user["email"],
-        created_at=created_user.get("created_at"),
+        id=user_doc["_id"],
+        name=user_doc["name"],
+        email=user_doc["email"],
+        created_at=user_doc["created_at"],
         
         # NEW FIELDS
-        streak=created_user.get("streak", 0),
-        xp=created_user.get("xp", 0),
-        total_checkins=created_user.get("total_checkins", 0),
-        last_active_date=created_user.get("last_active_date")
+        streak=user_doc["streak"],
+        xp=user_doc["xp"],
+        total_checkins=user_doc["total_checkins"],
+        last_active_date=user_doc["last_active_date"]
     )
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
     db = Depends(get_database)
 ):
@@ -190,6 +277,7 @@ async def login_for_access_token(
     - **username**: User's email (use email here)
     - **password**: User's password
     """
+    await limit_login(request, db, form_data.username)
     
     # Authenticate user (form_data.username contains email)
     user = await authenticate_user(form_data.username, form_data.password, db)
@@ -204,23 +292,25 @@ async def login_for_access_token(
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user["email"]},
+        data=access_token_data(user),
         expires_delta=access_token_expires
     )
     
     return {
         "access_token": access_token,
-        "token_type": "bearer"
+        "token_type": "bearer",
+        "refresh_token": create_refresh_token(user["email"])
     }
 
 @router.post("/login", response_model=Token)
-async def login_json(user_login: UserLogin, db = Depends(get_database)):
+async def login_json(user_login: UserLogin, request: Request, db = Depends(get_database)):
     """
     Login with JSON body to get access token (easier for API calls)
     
     - **email**: User's email
     - **password**: User's password
     """
+    await limit_login(request, db, user_login.email)
     
     # Authenticate user
     user = await authenticate_user(user_login.email, user_login.password, db)
@@ -232,29 +322,34 @@ async def login_json(user_login: UserLogin, db = Depends(get_database)):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    await update_locked_in_status(db, user)
     # ---------------------------------------
-    # DAILY LOGIN XP LOGIC
+    # DAILY LOGIN XP + LOCKED-IN LOGIC
+    # One atomic pipeline update, returns the post-update document
     # ---------------------------------------
-    from datetime import date, datetime
-    
     today = date.today()
-    last_login_iso = user.get("last_login_date")
-    last_login_date = None
-
-    if last_login_iso:
-        last_login_date = datetime.fromisoformat(last_login_iso).date()
-
-    # Only reward XP if user hasn't logged in today
-    if last_login_date != today:
-        await db.users.update_one(
-            {"email": user_login.email},
-            {
-                "$inc": {"xp": 20},  # Reward 20 XP
-                "$set": {"last_login_date": today.isoformat()}
-            }
-        )
-        print("⭐ Daily login bonus applied: +20 XP")
+
+    # Only reward XP if user hasn't logged in today; last_login_xp records
+    # what this login earned, so the post-update document tells us
+    daily_bonus = [
+        {"$set": {
+            "last_login_xp": {"$cond": [
+                {"$ne": [stored_day("last_login_date"), encode_day(today)]}, DAILY_LOGIN_XP, 0,
+            ]},
+        }},
+        {"$set": {
+            "xp": {"$add": [{"$ifNull": ["$xp", 0]}, "$last_login_xp"]},
+            "last_login_date": encode_day(today),
+        }},
+    ]
+
+    updated_user = await find_and_update_user(
+        db, user,
+        [*daily_bonus, *locked_in_evaluation_stages(today)],
+        PROGRESS
+    )
+
+    if updated_user.get("last_login_xp"):
+        print(f"⭐ Daily login bonus applied: +{DAILY_LOGIN_XP} XP")
     else:
         print("Daily login already counted. No XP this time.")
 
@@ -262,22 +357,66 @@ async def login_json(user_login: UserLogin, db = Depends(get_database)):
     # Create JWT access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user["email"]},
+        data=access_token_data(user),
         expires_delta=access_token_expires
     )
     
     return {
         "access_token": access_token,
         "token_type": "bearer",
-        "name": user["name"],
-        "mode": user.get("mode"),
-        "streak": user.get("streak", 0),
-        "xp": user.get("xp", 0),
-        "penalty_remaining": user.get("penalty_remaining", 0)
+        "refresh_token": create_refresh_token(user["email"]),
+        "name": updated_user["name"],
+        "mode": updated_user.get("mode"),
+        "streak": updated_user.get("streak", 0),
+        "xp": updated_user.get("xp", 0),
+        "penalty_remaining": updated_user.get("penalty_remaining", 0)
 
 
     }
 
+@router.post("/refresh", response_model=Token)
+async def refresh_access_token(body: RefreshRequest, db = Depends(get_database)):
+    """
+    Swap a refresh token for a new access token (no password check)
+
+    The refresh token is rotated: the one sent is revoked and a new one
+    is returned alongside the access token. Revoking it is the claim, so
+    a token replayed (or sent twice concurrently) only works once.
+    """
+    payload = decode_refresh_token(body.refresh_token)
+    # Fast path for tokens this worker already knows are revoked
+    if payload is None or await revocation_filter.is_revoked(db, payload["jti"]):
+        raise credentials_exception()
+
+    user = await find_user_by_email(db, payload["sub"], PROFILE)
+    if user is None:
+        raise credentials_exception()
+
+    if not await revocation_filter.revoke(db, payload):
+        raise credentials_exception()
+
+    access_token = create_access_token(
+        data=access_token_data(user),
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": create_refresh_token(user["email"])
+    }
+
+@router.post("/logout")
+async def logout(body: RefreshRequest, db = Depends(get_database)):
+    """
+    Revoke a refresh token so it can't be used again
+    """
+    payload = decode_refresh_token(body.refresh_token)
+    if payload is not None:
+        await revocation_filter.revoke(db, payload)
+
+    return {"message": "Logged out."}
+
 @router.get("/me", response_model=UserResponse)
 async def read_current_user(current_user: dict = Depends(get_current_user),
                             db=Depends(get_database)):
@@ -310,7 +449,7 @@ async def read_current_user(current_user: dict = Depends(get_current_user),
     )
 
 @router.get("/protected")
-async def protected_route(current_user: dict = Depends(get_current_user)):
+async def protected_route(current_user: dict = Depends(get_current_user_claims)):
     """
     Example of a protected route that requires authentication
     """
@@ -322,7 +461,7 @@ async def protected_route(current_user: dict = Depends(get_current_user)):
 
 @router.get("/debug/show-users")
 async def show_users(db = Depends(get_database)):
-    users = await db.users.find().to_list(10)
+    users = await list_users(db, CONTEXT, 10)
     for user in users:
         user["_id"] = str(user["_id"])
     print("Users in DB:", users)
@@ -332,24 +471,19 @@ async def show_users(db = Depends(get_database)):
 @router.post("/mode")
 async def update_mode(mode: str,
                       db=Depends(get_database),
-                      current_user=Depends(get_current_user)):
+                      current_user=Depends(get_current_user_claims)):
 
     if mode not in ["casual", "locked_in"]:
         raise HTTPException(status_code=400, detail="Invalid mode.")
 
-    await db.users.update_one(
-        {"_id": current_user["_id"]},
-        {"$set": {"mode": mode}}
-    )
+    await update_user(db, current_user, {"$set": {"mode": mode}})
 
     return {"message": f"Mode switched to {mode}."}
 
 @router.get("/chat/logs")
 async def get_chat_logs(db=Depends(get_database),
                         current_user=Depends(get_current_user)):
-    logs = await db.chat_logs.find({"user_id": current_user["_id"]}) \
-                             .sort("timestamp", 1) \
-                             .to_list(length=500)
+    logs = await read_chat_logs(db, current_user["_id"], limit=500)
 
     # Convert ObjectId to string for JSON serialization
     for log in logs:
@@ -359,3 +493,56 @@ async def get_chat_logs(db=Depends(get_database),
     return logs
 
 
+@router.get("/chat/history", response_model=ChatHistoryPage)
+async def get_chat_history(limit: int = Query(CHAT_HISTORY_PAGE_SIZE, ge=1, le=CHAT_HISTORY_MAX_PAGE_SIZE),
+                           cursor: str | None = None,
+                           order: str = Query("desc", pattern="^(asc|desc)$"),
+                           fields: str | None = None,
+                           db=Depends(get_database),
+                           current_user=Depends(get_current_user)):
+    """
+    Page through chat history (newest first by default)
+
+    - **limit**: Messages per page
+    - **cursor**: `next_cursor` from the previous page
+    - **order**: `desc` (newest first) or `asc`
+    - **fields**: Comma separated subset of `role,message,timestamp`
+    """
+    wanted = {f.strip() for f in fields.split(",") if f.strip()} if fields else None
+
+    try:
+        items, next_cursor = await read_chat_history(
+            db, current_user["_id"],
+            limit=limit,
+            cursor=cursor,
+            newest_first=order == "desc",
+            fields=wanted
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    for item in items:
+        item["_id"] = str(item["_id"])
+
+    return ChatHistoryPage(items=items, next_cursor=next_cursor)
+
+
+@router.get("/chat/export")
+async def export_chat_logs(compress: bool = False,
+                           db=Depends(get_database),
+                           current_user=Depends(get_current_user)):
+    """
+    Download the full chat history as NDJSON (one message per line)
+
+    - **compress**: Return gzip-compressed NDJSON
+    """
+    user_id = current_user["_id"]
+    filename = f"chat_history_{datetime.utcnow().date().isoformat()}.ndjson"
+    if compress:
+        filename += ".gz"
+
+    return StreamingResponse(
+        ndjson_stream(iter_chat_logs(db, user_id), compress=compress),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
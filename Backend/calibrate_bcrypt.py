@@ -0,0 +1,54 @@
+"""
+Benchmark bcrypt on this host and pick a cost factor
+
+Usage:
+    python calibrate_bcrypt.py --target-ms 250
+
+Prints the highest cost whose median verify time stays under the target.
+Set it as BCRYPT_ROUNDS; stored hashes made with another cost are
+rehashed transparently on the user's next login.
+"""
+
+import argparse
+import statistics
+import time
+from passlib.hash import bcrypt
+
+
+def time_verify(rounds: int, samples: int) -> float:
+    """Median seconds for one bcrypt verify at the given cost"""
+    hashed = bcrypt.using(rounds=rounds).hash("calibration-password")
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        bcrypt.verify("calibration-password", hashed)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def calibrate(target_ms: float, samples: int, min_rounds: int, max_rounds: int) -> int:
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        median_ms = time_verify(rounds, samples) * 1000
+        fits = median_ms <= target_ms
+        print(f"rounds={rounds:>2}  median verify={median_ms:8.1f} ms  {'ok' if fits else 'over target'}")
+        if not fits:
+            break
+        chosen = rounds
+    return chosen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick a bcrypt cost factor for this host")
+    parser.add_argument("--target-ms", type=float, default=250, help="max median verify time per login")
+    parser.add_argument("--samples", type=int, default=5, help="verifies timed per cost factor")
+    parser.add_argument("--min-rounds", type=int, default=10)
+    parser.add_argument("--max-rounds", type=int, default=16)
+    args = parser.parse_args()
+
+    rounds = calibrate(args.target_ms, args.samples, args.min_rounds, args.max_rounds)
+    print(f"\nRecommended: BCRYPT_ROUNDS={rounds}")
+
+
+if __name__ == "__main__":
+    main()
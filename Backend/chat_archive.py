@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import json
+import os
+import zlib
+from datetime import datetime, timedelta
+from bson import Binary, ObjectId
+from dotenv import load_dotenv
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+load_dotenv()
+
+# Configuration
+CHAT_HOT_RETENTION_DAYS = int(os.getenv("CHAT_HOT_RETENTION_DAYS", 90))  # kept uncompressed in chat_logs
+CHAT_ARCHIVE_RETENTION_DAYS = int(os.getenv("CHAT_ARCHIVE_RETENTION_DAYS", 0))  # 0 = keep forever
+CHAT_ARCHIVE_CHUNK_SIZE = int(os.getenv("CHAT_ARCHIVE_CHUNK_SIZE", 500))  # messages per archive doc
+
+
+# ============================================
+# ENCODING
+# ============================================
+
+def compress_messages(messages: list) -> Binary:
+    """zlib-compressed JSON array of {_id, role, message, timestamp}"""
+    rows = [
+        {
+            "_id": str(m["_id"]),
+            "role": m["role"],
+            "message": m["message"],
+            "timestamp": m["timestamp"].isoformat(),
+        }
+        for m in messages
+    ]
+    return Binary(zlib.compress(json.dumps(rows, ensure_ascii=False).encode("utf-8"), 9))
+
+
+def decompress_messages(data: bytes) -> list:
+    rows = json.loads(zlib.decompress(data).decode("utf-8"))
+    for row in rows:
+        row["_id"] = ObjectId(row["_id"])
+        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+    return rows
+
+
+def archive_messages(archive: dict) -> list:
+    return decompress_messages(archive["data"])
+
+
+# ============================================
+# COMPACTION (hot -> archive)
+# ============================================
+
+async def _write_archive(db, user_id, messages: list, now: datetime) -> set:
+    """
+    Store one compressed chunk
+
+    The _id is derived from the first message, so re-running after a crash
+    between insert and delete hits a duplicate key instead of archiving twice.
+    The chunk already stored under that _id may hold fewer messages than
+    this one (a later run saw more rows), so callers only drop what it holds.
+
+    Returns:
+        set: Message ids held by the archive document for this _id
+    """
+    doc = {
+        "_id": f"{user_id}:{messages[0]['_id']}",
+        "user_id": user_id,
+        "start": messages[0]["timestamp"],
+        "end": messages[-1]["timestamp"],
+        "count": len(messages),
+        "data": compress_messages(messages),
+        "archived_at": now,
+        "expires_at": (
+            messages[-1]["timestamp"] + timedelta(days=CHAT_ARCHIVE_RETENTION_DAYS)
+            if CHAT_ARCHIVE_RETENTION_DAYS > 0 else None
+        ),
+    }
+    try:
+        await db.chat_logs_archive.insert_one(doc)
+        return {m["_id"] for m in messages}
+    except DuplicateKeyError:
+        existing = await db.chat_logs_archive.find_one({"_id": doc["_id"]}, {"data": 1})
+        return {m["_id"] for m in archive_messages(existing)} if existing else set()
+
+
+async def _archive(db, user_id, messages: list, now: datetime, stats: dict) -> list:
+    """
+    Archive sorted messages, continuing past chunks already stored by an earlier run
+
+    Returns:
+        list: Ids of the messages now held by the archive
+    """
+    archived = []
+    while messages:
+        stored = await _write_archive(db, user_id, messages, now)
+        if messages[0]["_id"] not in stored:
+            break  # not ours to resolve, leave the rows for the next run
+        archived += [m["_id"] for m in messages if m["_id"] in stored]
+        messages = [m for m in messages if m["_id"] not in stored]
+        stats["chunks"] += 1
+    stats["messages"] += len(archived)
+    return archived
+
+
+async def _compact_documents(db, cutoff: datetime, now: datetime, stats: dict):
+    """Move per-message chat_logs older than cutoff into archive chunks"""
+    for user_id in await db.chat_logs.distinct("user_id", {"timestamp": {"$lt": cutoff}}):
+        cursor = db.chat_logs.find({"user_id": user_id, "timestamp": {"$lt": cutoff}}) \
+                             .sort([("timestamp", ASCENDING), ("_id", ASCENDING)]) \
+                             .batch_size(CHAT_ARCHIVE_CHUNK_SIZE)
+        chunk = []
+        async for doc in cursor:
+            chunk.append(doc)
+            if len(chunk) >= CHAT_ARCHIVE_CHUNK_SIZE:
+                await _archive_and_delete(db, user_id, chunk, now, stats)
+                chunk = []
+        if chunk:
+            await _archive_and_delete(db, user_id, chunk, now, stats)
+
+
+async def _compact_buckets(db, cutoff: datetime, now: datetime, stats: dict):
+    """
+    Move whole chat_log_buckets that ended before cutoff into archive chunks
+
+    The delete is conditioned on the bucket's count and end as archived: a
+    bucket the log writer appended to in between is kept, and the next run
+    archives only the messages the archive doesn't hold yet.
+    """
+    for user_id in await db.chat_log_buckets.distinct("user_id", {"end": {"$lt": cutoff}}):
+        cursor = db.chat_log_buckets.find({"user_id": user_id, "end": {"$lt": cutoff}}) \
+                                    .sort("start", ASCENDING)
+        async for bucket in cursor:
+            messages = sorted(bucket["messages"], key=lambda m: (m["timestamp"], m["_id"]))
+            archived = await _archive(db, user_id, messages, now, stats)
+            if len(archived) < len(messages):
+                continue
+            result = await db.chat_log_buckets.delete_one(
+                {"_id": bucket["_id"], "count": bucket["count"], "end": bucket["end"]}
+            )
+            if not result.deleted_count:
+                print(f"Chat log bucket {bucket['_id']} changed while archiving, kept for the next run")
+
+
+async def _archive_and_delete(db, user_id, chunk: list, now: datetime, stats: dict):
+    archived = await _archive(db, user_id, chunk, now, stats)
+    await db.chat_logs.delete_many({"_id": {"$in": archived}})
+
+
+async def compact_chat_logs(db, now: datetime | None = None) -> dict:
+    """
+    Compact everything older than CHAT_HOT_RETENTION_DAYS into chat_logs_archive
+
+    Works on both storage modes (chat_logs and chat_log_buckets), so it's
+    safe to run after switching modes.
+
+    Returns:
+        dict: Number of messages and archive chunks written
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=CHAT_HOT_RETENTION_DAYS)
+    stats = {"messages": 0, "chunks": 0}
+
+    await _compact_documents(db, cutoff, now, stats)
+    await _compact_buckets(db, cutoff, now, stats)
+
+    print(f"Compacted {stats['messages']} chat logs older than {cutoff.date()} into {stats['chunks']} archive chunks")
+    return stats
+
+
+async def _main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from database import MONGODB_URL, DATABASE_NAME
+    from indexes import ensure_indexes, indexes_for
+
+    parser = argparse.ArgumentParser(description="Compact old chat logs into the compressed archive")
+    parser.parse_args()
+
+    client = AsyncIOMotorClient(MONGODB_URL)
+    try:
+        db = client[DATABASE_NAME]
+        await ensure_indexes(db, indexes_for("chat_logs", "chat_log_buckets", "chat_logs_archive"))
+        await compact_chat_logs(db)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
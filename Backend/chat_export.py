@@ -0,0 +1,43 @@
+import json
+import zlib
+
+EXPORT_CHUNK_SIZE = 64 * 1024  # bytes handed to the response per write
+
+
+def _to_json_line(log: dict) -> bytes:
+    log["_id"] = str(log["_id"])
+    log["timestamp"] = log["timestamp"].isoformat()
+    return json.dumps(log, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+async def ndjson_stream(logs, compress: bool = False):
+    """
+    Encode an async iterator of chat logs as NDJSON bytes
+
+    Lines are grouped into ~EXPORT_CHUNK_SIZE chunks so the response isn't
+    written one tiny line at a time. With compress=True the output is a
+    gzip stream, compressed incrementally as the chunks go out.
+
+    Args:
+        logs: Async iterator of chat log dicts
+        compress: Gzip the stream
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 -> gzip header
+    buffer = bytearray()
+
+    async for log in logs:
+        buffer += _to_json_line(log)
+        if len(buffer) >= EXPORT_CHUNK_SIZE:
+            chunk = bytes(buffer)
+            buffer.clear()
+            if compressor:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+
+    chunk = bytes(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
@@ -0,0 +1,122 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+from pymongo.errors import BulkWriteError, PyMongoError
+from chat_storage import insert_chat_logs
+
+load_dotenv()
+
+# Configuration
+CHAT_LOG_BATCH_SIZE = int(os.getenv("CHAT_LOG_BATCH_SIZE", 200))
+CHAT_LOG_FLUSH_INTERVAL = float(os.getenv("CHAT_LOG_FLUSH_INTERVAL", 1.0))  # seconds
+CHAT_LOG_QUEUE_SIZE = int(os.getenv("CHAT_LOG_QUEUE_SIZE", 10000))
+
+
+class ChatLogWriter:
+    """
+    Write-behind buffer for chat logs
+
+    Messages are queued in memory and written to Mongo in one batch
+    (insert_many, or a bulk $push into buckets) whenever the batch is full
+    or the flush interval has passed.
+    The queue is bounded, so producers wait (backpressure) when it is full.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.queue: asyncio.Queue | None = None
+        self._db = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, db):
+        """Start the background flush loop (call once on startup)"""
+        if self.running:
+            return
+        self._db = db
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+        print(f"Chat log writer started (batch={self.batch_size}, interval={self.flush_interval}s)")
+
+    async def enqueue(self, doc: dict):
+        """
+        Queue a chat log document for writing
+
+        Waits if the queue is full so a slow database slows producers down
+        instead of growing memory without bound.
+        """
+        await self.queue.put(doc)
+
+    async def stop(self):
+        """Flush everything that is still queued and stop the loop"""
+        if not self.running:
+            return
+        # Sentinel tells the loop to drain and exit
+        await self.queue.put(None)
+        await self._task
+        self._task = None
+        print("Chat log writer stopped, all pending logs flushed")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            # Block until there is at least one message
+            first = await self.queue.get()
+            if first is None:
+                return
+
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+
+            # Keep collecting until the batch is full or the interval runs out
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    doc = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if doc is None:
+                    stopping = True
+                    break
+                batch.append(doc)
+
+            await self._flush(batch)
+
+            if stopping:
+                # Drain anything producers queued after the sentinel
+                rest = []
+                while not self.queue.empty():
+                    doc = self.queue.get_nowait()
+                    if doc is not None:
+                        rest.append(doc)
+                for i in range(0, len(rest), self.batch_size):
+                    await self._flush(rest[i:i + self.batch_size])
+                return
+
+    async def _flush(self, batch: list):
+        """Write one batch, unordered so a single bad document doesn't stop the rest"""
+        if not batch:
+            return
+        try:
+            await insert_chat_logs(self._db, batch)
+        except BulkWriteError as e:
+            print(f"Chat log flush partially failed: {len(e.details.get('writeErrors', []))} errors")
+        except PyMongoError as e:
+            # Chat logs are best effort, a failed batch must not kill the loop
+            print(f"Chat log flush failed, dropped {len(batch)} logs: {e}")
+
+
+chat_log_writer = ChatLogWriter(
+    batch_size=CHAT_LOG_BATCH_SIZE,
+    flush_interval=CHAT_LOG_FLUSH_INTERVAL,
+    max_queue=CHAT_LOG_QUEUE_SIZE,
+)
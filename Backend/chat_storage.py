@@ -0,0 +1,404 @@
+import argparse
+import asyncio
+import base64
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from chat_archive import archive_messages
+
+load_dotenv()
+
+# Configuration
+# "documents" = one document per message in chat_logs (default)
+# "buckets"   = one document per user per N messages / time window in chat_log_buckets
+CHAT_LOG_STORAGE = os.getenv("CHAT_LOG_STORAGE", "documents")
+CHAT_BUCKET_SIZE = int(os.getenv("CHAT_BUCKET_SIZE", 200))  # messages per bucket
+CHAT_BUCKET_WINDOW_HOURS = int(os.getenv("CHAT_BUCKET_WINDOW_HOURS", 0))  # 0 = no time window
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", 50))
+CHAT_HISTORY_MAX_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_MAX_PAGE_SIZE", 200))
+CHAT_EXPORT_BATCH_SIZE = int(os.getenv("CHAT_EXPORT_BATCH_SIZE", 1000))  # docs per cursor batch
+
+# Fields a history page may project, _id and timestamp always come back (cursor keys)
+CHAT_HISTORY_FIELDS = {"role", "message", "timestamp"}
+
+
+def use_buckets() -> bool:
+    return CHAT_LOG_STORAGE == "buckets"
+
+
+def bucket_window(timestamp: datetime) -> datetime | None:
+    """Start of the time window a message belongs to (None when windows are off)"""
+    if CHAT_BUCKET_WINDOW_HOURS <= 0:
+        return None
+    window = timedelta(hours=CHAT_BUCKET_WINDOW_HOURS)
+    return datetime.min + ((timestamp - datetime.min) // window) * window
+
+
+def to_bucket_message(doc: dict) -> dict:
+    """Strip the per-message user_id, it lives once on the bucket"""
+    return {
+        "_id": doc.get("_id") or ObjectId(),
+        "role": doc["role"],
+        "message": doc["message"],
+        "timestamp": doc["timestamp"],
+    }
+
+
+# ============================================
+# WRITES
+# ============================================
+
+async def insert_chat_logs(db, docs: list):
+    """
+    Write a batch of chat log documents using the configured storage mode
+
+    Args:
+        db: Database instance
+        docs: Chat log documents ({user_id, role, message, timestamp})
+    """
+    if not docs:
+        return
+    if use_buckets():
+        await append_to_buckets(db, docs)
+    else:
+        await db.chat_logs.insert_many(docs, ordered=False)
+
+
+async def append_to_buckets(db, docs: list):
+    """
+    Append messages to each user's open bucket with $push / $inc
+
+    One UpdateOne per (user, window) goes out in a single bulk_write.
+    A bucket is open while open is true and count < CHAT_BUCKET_SIZE; a
+    batch may overshoot the size a little, the next write then opens a new
+    bucket. Buckets written by migrate_to_buckets are closed, so live
+    messages never land in them.
+
+    A unique partial index (indexes.py) allows one open bucket per user and
+    window: of two workers opening it at once, the loser hits a duplicate
+    key and retries against the bucket the winner created.
+    """
+    grouped = defaultdict(list)
+    for doc in docs:
+        grouped[(doc["user_id"], bucket_window(doc["timestamp"]))].append(doc)
+
+    ops = []
+    for (user_id, window), user_docs in grouped.items():
+        user_docs.sort(key=lambda d: d["timestamp"])
+        ops.append(UpdateOne(
+            {"user_id": user_id, "window": window, "open": True, "count": {"$lt": CHAT_BUCKET_SIZE}},
+            {
+                "$push": {"messages": {"$each": [to_bucket_message(d) for d in user_docs]}},
+                "$inc": {"count": len(user_docs)},
+                "$min": {"start": user_docs[0]["timestamp"]},
+                "$max": {"end": user_docs[-1]["timestamp"]},
+            },
+            upsert=True,
+        ))
+
+    for attempt in range(3):
+        try:
+            await db.chat_log_buckets.bulk_write(ops, ordered=False)
+            return
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if attempt == 2 or not errors or any(err.get("code") != 11000 for err in errors):
+                raise
+            # Only the lost upsert races are retried, the other ops were applied
+            ops = [ops[err["index"]] for err in errors]
+
+
+# ============================================
+# READS
+# ============================================
+
+async def read_chat_logs(db, user_id, limit: int = 500) -> list:
+    """
+    Read a user's oldest `limit` chat logs in timestamp order
+
+    Returns flat message dicts in both storage modes, archived messages
+    included (pages through read_chat_history oldest-first).
+    """
+    logs, cursor = [], None
+    while len(logs) < limit:
+        page, cursor = await read_chat_history(db, user_id, limit - len(logs), cursor, newest_first=False)
+        logs += [{"user_id": user_id, **msg} for msg in page]
+        if cursor is None:
+            break
+    return logs
+
+
+async def iter_chat_logs(db, user_id, batch_size: int = CHAT_EXPORT_BATCH_SIZE):
+    """
+    Yield every chat log of a user, oldest first, straight off a Mongo cursor
+
+    Archived (compressed) messages come first, then the hot tier.
+    Only one cursor batch is held in memory at a time, whatever the
+    size of the history.
+    """
+    # Each archive chunk already holds many messages, keep its batches small
+    archive = db.chat_logs_archive.find({"user_id": user_id}, {"data": 1}) \
+                                  .sort("start", ASCENDING) \
+                                  .batch_size(1)
+    async for chunk in archive:
+        for msg in archive_messages(chunk):
+            yield msg
+
+    if not use_buckets():
+        cursor = db.chat_logs.find({"user_id": user_id}, {"user_id": 0}) \
+                             .sort([("timestamp", ASCENDING), ("_id", ASCENDING)]) \
+                             .batch_size(batch_size)
+        async for log in cursor:
+            yield log
+        return
+
+    # A bucket already holds up to CHAT_BUCKET_SIZE messages, scale the batch down
+    bucket_batch = max(1, batch_size // CHAT_BUCKET_SIZE)
+    cursor = db.chat_log_buckets.find({"user_id": user_id}, {"messages": 1}) \
+                                .sort("start", ASCENDING) \
+                                .batch_size(bucket_batch)
+    async for bucket in cursor:
+        for msg in sorted(bucket["messages"], key=lambda m: (m["timestamp"], m["_id"])):
+            yield msg
+
+
+# ============================================
+# KEYSET PAGINATION
+# ============================================
+
+def encode_cursor(log: dict) -> str:
+    """Opaque cursor pointing at the (timestamp, _id) of the last item on a page"""
+    raw = f"{log['timestamp'].isoformat()}|{log['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, ObjectId]:
+    """
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, log_id = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), ObjectId(log_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _after_cursor(key: tuple, cursor: tuple | None, newest_first: bool) -> bool:
+    """Is (timestamp, _id) strictly past the cursor in page order"""
+    if cursor is None:
+        return True
+    return key < cursor if newest_first else key > cursor
+
+
+async def read_chat_history(db, user_id, limit: int = CHAT_HISTORY_PAGE_SIZE,
+                            cursor: str | None = None, newest_first: bool = True,
+                            fields: set | None = None) -> tuple[list, str | None]:
+    """
+    Read one page of a user's chat history with keyset pagination
+
+    The page is a range scan on (user_id, timestamp, _id) starting right
+    after the cursor, so its cost doesn't depend on how many messages
+    the user has in total. Pages read through to the compressed archive
+    once the hot tier runs out (archived messages are always older).
+
+    Args:
+        db: Database instance
+        user_id: Owner of the history
+        limit: Page size (capped at CHAT_HISTORY_MAX_PAGE_SIZE)
+        cursor: next_cursor from the previous page, None for the first page
+        newest_first: Sort newest to oldest (default) or oldest to newest
+        fields: Subset of CHAT_HISTORY_FIELDS to return, None for all
+
+    Returns:
+        tuple: (items, next_cursor) where next_cursor is None on the last page
+
+    Raises:
+        ValueError: If the cursor or field list is invalid
+    """
+    limit = max(1, min(limit, CHAT_HISTORY_MAX_PAGE_SIZE))
+    fields = CHAT_HISTORY_FIELDS if fields is None else set(fields)
+    unknown = fields - CHAT_HISTORY_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    after = decode_cursor(cursor) if cursor else None
+
+    async def read_hot(want, after):
+        if use_buckets():
+            return await _history_from_chunks(db.chat_log_buckets, lambda b: b["messages"],
+                                              user_id, want, after, newest_first)
+        return await _history_from_documents(db, user_id, want, after, newest_first, fields)
+
+    async def read_archive(want, after):
+        return await _history_from_chunks(db.chat_logs_archive, archive_messages,
+                                          user_id, want, after, newest_first)
+
+    # Tiers in page order: hot holds the newest messages, the archive the oldest
+    tiers = [read_hot, read_archive] if newest_first else [read_archive, read_hot]
+
+    items = []
+    for read_tier in tiers:
+        items += await read_tier(limit + 1 - len(items), after)
+        if len(items) > limit:
+            break
+
+    # One extra item tells us whether there is another page
+    next_cursor = encode_cursor(items[limit - 1]) if len(items) > limit else None
+    items = items[:limit]
+
+    keep = fields | {"_id", "timestamp"}
+    return [{k: v for k, v in item.items() if k in keep} for item in items], next_cursor
+
+
+async def _history_from_documents(db, user_id, limit, after, newest_first, fields):
+    direction = DESCENDING if newest_first else ASCENDING
+    query = {"user_id": user_id}
+
+    if after is not None:
+        op = "$lt" if newest_first else "$gt"
+        timestamp, log_id = after
+        query["$or"] = [
+            {"timestamp": {op: timestamp}},
+            {"timestamp": timestamp, "_id": {op: log_id}},
+        ]
+
+    projection = {field: 1 for field in fields | {"timestamp"}}
+    return await db.chat_logs.find(query, projection) \
+                             .sort([("timestamp", direction), ("_id", direction)]) \
+                             .limit(limit) \
+                             .to_list(length=limit)
+
+
+async def _history_from_chunks(collection, messages_of, user_id, limit, after, newest_first):
+    """
+    Page over multi-message documents (buckets or archive chunks) with {start, end}
+
+    Args:
+        collection: chat_log_buckets or chat_logs_archive
+        messages_of: Function returning the messages stored in one document
+    """
+    query = {"user_id": user_id}
+    if after is not None:
+        # Chunks that start after (or end before) the cursor can't contribute
+        timestamp = after[0]
+        query["start" if newest_first else "end"] = {"$lte" if newest_first else "$gte": timestamp}
+
+    # Chunks can overlap in time (migrated next to live buckets, concurrent
+    # appends), so walk them by the edge a page approaches: newest-first by
+    # end, oldest-first by start. Once the page is full and its last item is
+    # past the next chunk's edge, no later chunk can hold a better message.
+    edge = "end" if newest_first else "start"
+    direction = DESCENDING if newest_first else ASCENDING
+    cursor = collection.find(query).sort([(edge, direction), ("_id", direction)])
+
+    items = []
+    async for chunk in cursor:
+        if len(items) >= limit:
+            boundary = items[limit - 1]["timestamp"]
+            if (boundary > chunk[edge]) if newest_first else (boundary < chunk[edge]):
+                break
+        for msg in messages_of(chunk):
+            if _after_cursor((msg["timestamp"], msg["_id"]), after, newest_first):
+                items.append(msg)
+        items.sort(key=lambda m: (m["timestamp"], m["_id"]), reverse=newest_first)
+        del items[limit:]
+
+    return items
+
+
+# ============================================
+# MIGRATION (chat_logs -> chat_log_buckets)
+# ============================================
+
+async def migrate_to_buckets(db, delete_source: bool = False) -> dict:
+    """
+    Copy per-message chat_logs into buckets, one user at a time
+
+    Idempotent by message _id: messages already in one of the user's
+    buckets (an earlier or interrupted run) are skipped, everything else
+    is copied. So it can be re-run at any point of the cutover, in either
+    storage mode, and picks up messages written since the last run.
+    Migrated buckets are closed (open: false), live appends never join them.
+
+    Args:
+        db: Database instance
+        delete_source: Remove the original documents once a user is migrated
+
+    Returns:
+        dict: Counts of users, messages and buckets migrated, and messages
+        skipped because they were already in buckets
+    """
+    stats = {"users": 0, "skipped": 0, "messages": 0, "buckets": 0}
+
+    for user_id in await db.chat_logs.distinct("user_id"):
+        bucketed = set()
+        async for bucket in db.chat_log_buckets.find({"user_id": user_id}, {"messages._id": 1}):
+            bucketed.update(msg["_id"] for msg in bucket.get("messages", []))
+
+        buckets = []
+        current = None
+        migrated_ids = []
+        already_migrated = []
+
+        cursor = db.chat_logs.find({"user_id": user_id}).sort("timestamp", 1)
+        async for doc in cursor:
+            if doc["_id"] in bucketed:
+                already_migrated.append(doc["_id"])
+                continue
+            window = bucket_window(doc["timestamp"])
+            if current is None or current["count"] >= CHAT_BUCKET_SIZE or current["window"] != window:
+                current = {
+                    "user_id": user_id,
+                    "window": window,
+                    "open": False,
+                    "count": 0,
+                    "start": doc["timestamp"],
+                    "end": doc["timestamp"],
+                    "messages": [],
+                }
+                buckets.append(current)
+            current["messages"].append(to_bucket_message(doc))
+            current["count"] += 1
+            current["end"] = doc["timestamp"]
+            migrated_ids.append(doc["_id"])
+
+        if buckets:
+            await db.chat_log_buckets.insert_many(buckets)
+        if delete_source:
+            source_ids = migrated_ids + already_migrated
+            for i in range(0, len(source_ids), 1000):
+                await db.chat_logs.delete_many({"_id": {"$in": source_ids[i:i + 1000]}})
+
+        stats["users"] += 1
+        stats["skipped"] += len(already_migrated)
+        stats["messages"] += len(migrated_ids)
+        stats["buckets"] += len(buckets)
+        print(f"Migrated {len(migrated_ids)} messages into {len(buckets)} buckets for {user_id}")
+
+    return stats
+
+
+async def _main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from database import MONGODB_URL, DATABASE_NAME
+
+    parser = argparse.ArgumentParser(description="Migrate chat_logs into per-user buckets")
+    parser.add_argument("--delete-source", action="store_true",
+                        help="delete the original chat_logs documents after migrating")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(MONGODB_URL)
+    try:
+        stats = await migrate_to_buckets(client[DATABASE_NAME], delete_source=args.delete_source)
+        print("Migration done:", stats)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
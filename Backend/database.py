@@ -1,7 +1,11 @@
 import os
+import threading
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from pymongo import MongoClient
+from pymongo.monitoring import ConnectionPoolListener
+from metrics import metrics
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -9,26 +13,136 @@ load_dotenv()
 MONGODB_URL = os.getenv("MONGODB_URL")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 
+# Connection pool settings, size max pool against (workers x expected concurrency)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_TIME_MS = os.getenv("MONGO_MAX_IDLE_TIME_MS")  # unset = keep idle connections
+MONGO_WAIT_QUEUE_TIMEOUT_MS = os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS")  # unset = wait forever for a connection
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 30000))
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")  # e.g. "zstd,snappy,zlib"
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+
 print("MONGODB_URL:", MONGODB_URL)
 print("DATABASE_NAME:", DATABASE_NAME)
 
+
+class PoolMetricsListener(ConnectionPoolListener):
+    """
+    Feeds connection pool events into /metrics
+
+    mongo_pool_checkout_wait_seconds shows how long requests queue for a
+    connection, mongo_pool_in_use how many connections are checked out.
+    """
+
+    def __init__(self):
+        # Events arrive on pymongo's pool threads
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.open = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        metrics.inc("mongo_pool_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+            metrics.set_gauge("mongo_pool_open", self.open)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+            metrics.set_gauge("mongo_pool_open", self.open)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        metrics.inc(f"mongo_pool_checkout_failed_{event.reason}")
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.in_use += 1
+            metrics.set_gauge("mongo_pool_in_use", self.in_use)
+        # duration (seconds) is reported by pymongo >= 4.7
+        duration = getattr(event, "duration", None)
+        if duration is not None:
+            metrics.observe("mongo_pool_checkout_wait_seconds", duration)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+            metrics.set_gauge("mongo_pool_in_use", self.in_use)
+
+
 class Database:
     client: AsyncIOMotorClient = None
-    
+    db: AsyncIOMotorDatabase = None
+
 database = Database()
 
+
+def client_options() -> dict:
+    """Keyword arguments for AsyncIOMotorClient built from the MONGO_* settings"""
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "readPreference": MONGO_READ_PREFERENCE,
+        "event_listeners": [PoolMetricsListener()],
+    }
+    if MONGO_MAX_IDLE_TIME_MS:
+        options["maxIdleTimeMS"] = int(MONGO_MAX_IDLE_TIME_MS)
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = int(MONGO_WAIT_QUEUE_TIMEOUT_MS)
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+
 async def get_database():
-    """Dependency to get database instance"""
-    return database.client[DATABASE_NAME]
+    """Dependency to get database instance (cached handle, no per-request lookup)"""
+    return database.db
 
 async def connect_to_mongo():
     """Connect to MongoDB on startup"""
+    if MONGODB_URL and MONGODB_URL.startswith("memory://"):
+        # In-process stand-in for load tests and benchmarks, nothing is persisted
+        from fake_db import FakeMongoClient
+        print("Using the in-memory database (MONGODB_URL=memory://)")
+        database.client = FakeMongoClient()
+        database.db = database.client[DATABASE_NAME or "test"]
+        return
+
     print("Connecting to MongoDB...")
-    database.client = AsyncIOMotorClient(MONGODB_URL)
-    print("Connected to MongoDB!")
-    
+    database.client = AsyncIOMotorClient(MONGODB_URL, **client_options())
+    database.db = database.client[DATABASE_NAME]
+    print(f"Connected to MongoDB! (pool {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE})")
+
 async def close_mongo_connection():
     """Close MongoDB connection on shutdown"""
     print("Closing MongoDB connection...")
     database.client.close()
-    print("MongoDB connection closed!")
\ No newline at end of file
+    database.client = None
+    database.db = None
+    print("MongoDB connection closed!")
+
+@asynccontextmanager
+async def mongo_lifespan():
+    """Open the client for the lifetime of the app, close it on the way out"""
+    await connect_to_mongo()
+    try:
+        yield database.db
+    finally:
+        await close_mongo_connection()
@@ -0,0 +1,887 @@
+"""
+In-memory stand-in for the parts of Motor this API uses
+
+Lets the whole app run without a MongoDB server (load tests, benchmarks,
+local experiments). Enable it with MONGODB_URL=memory:// and every
+get_database() call gets a FakeDatabase instead of a Motor database.
+
+Covered:
+    find / find_one (filters with $eq $ne $gt $gte $lt $lte $in $nin $exists $type $and $or $nor $expr)
+    cursor sort / skip / limit / batch_size / to_list / async for
+    insert_one / insert_many / update_one / update_many / delete_one / delete_many
+    find_one_and_update (ReturnDocument, projection, upsert)
+    bulk_write with InsertOne / UpdateOne / UpdateMany / DeleteOne / DeleteMany
+    update operators $set $unset $inc $min $max $push($each) $setOnInsert
+    pipeline updates ($set / $addFields / $unset with the common expressions)
+    distinct / count_documents / create_index / index_information (unique and partial unique enforced)
+
+Every operation runs to completion before yielding to the event loop, so
+each single-document write is atomic like it is on a real server.
+Projections only look at top-level fields.
+"""
+
+import asyncio
+import copy
+import math
+from datetime import date, datetime, timedelta
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import (
+    BulkWriteResult,
+    DeleteResult,
+    InsertManyResult,
+    InsertOneResult,
+    UpdateResult,
+)
+
+_MISSING = object()
+
+
+# ============================================
+# VALUES AND COMPARISON
+# ============================================
+
+def _type_rank(value) -> int:
+    """BSON comparison order between types"""
+    if value is None or value is _MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def _sort_key(value):
+    if value is _MISSING:
+        value = None
+    if isinstance(value, list):
+        return (_type_rank(value), [_sort_key(v) for v in value])
+    if isinstance(value, dict):
+        return (_type_rank(value), [(k, _sort_key(v)) for k, v in value.items()])
+    if value is None:
+        return (1, 0)
+    return (_type_rank(value), value)
+
+
+def _compare(a, b) -> int:
+    ka, kb = _sort_key(a), _sort_key(b)
+    return (ka > kb) - (ka < kb)
+
+
+def _get_path(doc, path: str):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+    return value
+
+
+def _set_path(doc: dict, path: str, value):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def _unset_path(doc: dict, path: str):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(last, None)
+
+
+# ============================================
+# QUERY MATCHING
+# ============================================
+
+def _values_equal(field_value, target) -> bool:
+    if field_value is _MISSING:
+        return target is None
+    if isinstance(field_value, list) and not isinstance(target, list):
+        return any(_values_equal(v, target) for v in field_value)
+    return _type_rank(field_value) == _type_rank(target) and field_value == target
+
+
+def _compare_op(field_value, target, accept) -> bool:
+    candidates = field_value if isinstance(field_value, list) else [field_value]
+    for value in candidates:
+        if value is _MISSING:
+            value = None
+        # Range operators only match within the same type bracket
+        if _type_rank(value) == _type_rank(target) and accept(_compare(value, target)):
+            return True
+    return False
+
+
+_BSON_TYPES = [
+    (bool, "bool"), (int, "int"), (float, "double"), (str, "string"), (dict, "object"),
+    (list, "array"), (bytes, "binData"), (ObjectId, "objectId"), (datetime, "date"),
+]
+
+
+def _bson_type(value) -> str:
+    if value is None:
+        return "null"
+    for python_type, alias in _BSON_TYPES:
+        if isinstance(value, python_type):
+            return alias
+    return "unknown"
+
+
+def _match_operators(field_value, condition: dict) -> bool:
+    for op, target in condition.items():
+        if op == "$eq":
+            ok = _values_equal(field_value, target)
+        elif op == "$ne":
+            ok = not _values_equal(field_value, target)
+        elif op == "$gt":
+            ok = _compare_op(field_value, target, lambda c: c > 0)
+        elif op == "$gte":
+            ok = _compare_op(field_value, target, lambda c: c >= 0)
+        elif op == "$lt":
+            ok = _compare_op(field_value, target, lambda c: c < 0)
+        elif op == "$lte":
+            ok = _compare_op(field_value, target, lambda c: c <= 0)
+        elif op == "$in":
+            ok = any(_values_equal(field_value, t) for t in target)
+        elif op == "$nin":
+            ok = not any(_values_equal(field_value, t) for t in target)
+        elif op == "$exists":
+            ok = (field_value is not _MISSING) == bool(target)
+        elif op == "$type":
+            types = target if isinstance(target, list) else [target]
+            ok = field_value is not _MISSING and _bson_type(field_value) in types
+        elif op == "$not":
+            ok = not _match_operators(field_value, target)
+        else:
+            raise OperationFailure(f"fake_db: unsupported query operator {op}")
+        if not ok:
+            return False
+    return True
+
+
+def matches(doc: dict, query: dict | None) -> bool:
+    """True if doc matches a MongoDB filter"""
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            ok = all(matches(doc, q) for q in condition)
+        elif key == "$or":
+            ok = any(matches(doc, q) for q in condition)
+        elif key == "$nor":
+            ok = not any(matches(doc, q) for q in condition)
+        elif key == "$expr":
+            ok = bool(evaluate(condition, doc))
+        elif isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+            ok = _match_operators(_get_path(doc, key), condition)
+        else:
+            ok = _values_equal(_get_path(doc, key), condition)
+        if not ok:
+            return False
+    return True
+
+
+# ============================================
+# AGGREGATION EXPRESSIONS (pipeline updates)
+# ============================================
+
+def _to_date(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return parsed.replace(tzinfo=None) - (parsed.utcoffset() or timedelta(0))
+    if isinstance(value, (int, float)):
+        return datetime(1970, 1, 1) + timedelta(milliseconds=value)
+    if isinstance(value, ObjectId):
+        return value.generation_time.replace(tzinfo=None)
+    raise OperationFailure(f"fake_db: can't convert {value!r} to a date")
+
+
+def _add(values):
+    dates = [v for v in values if isinstance(v, datetime)]
+    if any(v is None for v in values):
+        return None
+    total = sum(v for v in values if not isinstance(v, datetime))
+    if dates:
+        return dates[0] + timedelta(milliseconds=total)
+    return total
+
+
+def _subtract(a, b):
+    if a is None or b is None:
+        return None
+    if isinstance(a, datetime) and isinstance(b, datetime):
+        return int((a - b) / timedelta(milliseconds=1))
+    if isinstance(a, datetime):
+        return a - timedelta(milliseconds=b)
+    return a - b
+
+
+def _multiply(values):
+    if any(v is None for v in values):
+        return None
+    return math.prod(values)
+
+
+def _null_safe(fn):
+    def wrapped(*args):
+        if any(a is None for a in args):
+            return None
+        return fn(*args)
+    return wrapped
+
+
+def _cond(args, doc):
+    if isinstance(args, dict):
+        args = [args["if"], args["then"], args["else"]]
+    condition, then, otherwise = args
+    return evaluate(then, doc) if _truthy(evaluate(condition, doc)) else evaluate(otherwise, doc)
+
+
+def _truthy(value) -> bool:
+    return value not in (None, False, 0, _MISSING)
+
+
+def _date_part(unit):
+    def part(arg):
+        value = arg["date"] if isinstance(arg, dict) else arg
+        return None if value is None else getattr(_to_date(value), unit)
+    return part
+
+
+def _if_null(args, doc):
+    for arg in args[:-1]:
+        value = evaluate(arg, doc)
+        if value is not None and value is not _MISSING:
+            return value
+    return evaluate(args[-1], doc)
+
+
+# Operators that take evaluated argument lists
+_LIST_OPERATORS = {
+    "$add": _add,
+    "$subtract": lambda v: _subtract(*v),
+    "$multiply": _multiply,
+    "$divide": lambda v: _null_safe(lambda a, b: a / b)(*v),
+    "$mod": lambda v: _null_safe(lambda a, b: math.fmod(a, b))(*v),
+    "$pow": lambda v: _null_safe(lambda a, b: a ** b)(*v),
+    "$eq": lambda v: _compare(*v) == 0,
+    "$ne": lambda v: _compare(*v) != 0,
+    "$gt": lambda v: _compare(*v) > 0,
+    "$gte": lambda v: _compare(*v) >= 0,
+    "$lt": lambda v: _compare(*v) < 0,
+    "$lte": lambda v: _compare(*v) <= 0,
+    "$and": lambda v: all(_truthy(x) for x in v),
+    "$or": lambda v: any(_truthy(x) for x in v),
+    "$not": lambda v: not _truthy(v[0]),
+    "$in": lambda v: v[0] in v[1],
+    "$concat": lambda v: None if None in v else "".join(v),
+    "$size": lambda v: len(v[0]),
+    "$arrayElemAt": lambda v: v[0][v[1]] if -len(v[0]) <= v[1] < len(v[0]) else _MISSING,
+}
+
+# Operators that take a single evaluated argument
+_UNARY_OPERATORS = {
+    "$floor": _null_safe(math.floor),
+    "$ceil": _null_safe(math.ceil),
+    "$abs": _null_safe(abs),
+    "$toDate": _to_date,
+    "$toString": _null_safe(lambda v: v.isoformat() if isinstance(v, (date, datetime)) else str(v)),
+    "$toInt": _null_safe(int),
+    "$toDouble": _null_safe(float),
+    "$dayOfWeek": _date_part("isoweekday"),
+}
+
+
+def evaluate(expr, doc: dict):
+    """Evaluate an aggregation expression against a document"""
+    if isinstance(expr, str) and expr.startswith("$"):
+        if expr == "$$NOW":
+            return datetime.utcnow()
+        if expr.startswith("$$ROOT"):
+            return doc if expr == "$$ROOT" else _get_path(doc, expr[len("$$ROOT."):])
+        return _get_path(doc, expr[1:])
+    if isinstance(expr, list):
+        return [_missing_to_none(evaluate(e, doc)) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) == 1:
+        op, args = next(iter(expr.items()))
+        if op.startswith("$"):
+            return _evaluate_operator(op, args, doc)
+    return {k: evaluate(v, doc) for k, v in expr.items()}
+
+
+def _missing_to_none(value):
+    return None if value is _MISSING else value
+
+
+def _evaluate_operator(op: str, args, doc: dict):
+    if op == "$literal":
+        return args
+    if op == "$cond":
+        return _cond(args, doc)
+    if op == "$ifNull":
+        return _if_null(args, doc)
+    if op in ("$min", "$max"):
+        values = evaluate(args, doc)
+        values = [v for v in (values if isinstance(values, list) else [values]) if v is not None]
+        if not values:
+            return None
+        pick = min if op == "$min" else max
+        return pick(values, key=_sort_key)
+    if op in _LIST_OPERATORS:
+        values = evaluate(args if isinstance(args, list) else [args], doc)
+        return _LIST_OPERATORS[op](values)
+    if op in _UNARY_OPERATORS:
+        value = _missing_to_none(evaluate(args[0] if isinstance(args, list) else args, doc))
+        return _UNARY_OPERATORS[op](value)
+    raise OperationFailure(f"fake_db: unsupported expression operator {op}")
+
+
+# ============================================
+# UPDATES
+# ============================================
+
+def _apply_pipeline(doc: dict, pipeline: list) -> dict:
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name in ("$set", "$addFields"):
+            # All expressions in a stage see the document as it was before the stage
+            values = {path: evaluate(expr, doc) for path, expr in spec.items()}
+            for path, value in values.items():
+                if value is _MISSING:
+                    _unset_path(doc, path)
+                else:
+                    _set_path(doc, path, copy.deepcopy(value))
+        elif name == "$unset":
+            for path in [spec] if isinstance(spec, str) else spec:
+                _unset_path(doc, path)
+        elif name == "$replaceWith":
+            replacement = evaluate(spec, doc)
+            replacement["_id"] = doc["_id"]
+            doc.clear()
+            doc.update(replacement)
+        else:
+            raise OperationFailure(f"fake_db: unsupported pipeline stage {name}")
+    return doc
+
+
+def _apply_operators(doc: dict, update: dict, inserting: bool) -> dict:
+    for op, fields in update.items():
+        for path, value in fields.items():
+            current = _get_path(doc, path)
+            if op == "$set":
+                _set_path(doc, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                if inserting:
+                    _set_path(doc, path, copy.deepcopy(value))
+            elif op == "$unset":
+                _unset_path(doc, path)
+            elif op == "$inc":
+                _set_path(doc, path, (0 if current is _MISSING else current) + value)
+            elif op == "$min":
+                if current is _MISSING or _compare(value, current) < 0:
+                    _set_path(doc, path, copy.deepcopy(value))
+            elif op == "$max":
+                if current is _MISSING or _compare(value, current) > 0:
+                    _set_path(doc, path, copy.deepcopy(value))
+            elif op == "$push":
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                array = [] if current is _MISSING else current
+                array.extend(copy.deepcopy(items))
+                _set_path(doc, path, array)
+            else:
+                raise OperationFailure(f"fake_db: unsupported update operator {op}")
+    return doc
+
+
+def apply_update(doc: dict, update, inserting: bool = False) -> dict:
+    """Apply an update document or pipeline to a copy of doc, returns the new document"""
+    doc = copy.deepcopy(doc)
+    if isinstance(update, list):
+        return _apply_pipeline(doc, update)
+    return _apply_operators(doc, update, inserting)
+
+
+def _upsert_seed(query: dict) -> dict:
+    """Equality parts of a filter, which MongoDB copies into an upserted document"""
+    seed = {}
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            for q in condition:
+                seed.update(_upsert_seed(q))
+        elif key.startswith("$"):
+            continue
+        elif isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+            if "$eq" in condition:
+                _set_path(seed, key, copy.deepcopy(condition["$eq"]))
+        else:
+            _set_path(seed, key, copy.deepcopy(condition))
+    return seed
+
+
+def _include_path(value, parts: list):
+    """Inclusion projection of a dotted path, descending into arrays of subdocuments"""
+    if not parts:
+        return copy.deepcopy(value)
+    if isinstance(value, list):
+        items = [_include_path(item, parts) for item in value if isinstance(item, dict)]
+        return [{} if item is _MISSING else item for item in items]
+    if isinstance(value, dict) and parts[0] in value:
+        return {parts[0]: _include_path(value[parts[0]], parts[1:])}
+    return _MISSING
+
+
+def project(doc: dict, projection) -> dict:
+    """Apply a find() projection (exclusions are top-level only)"""
+    if not projection:
+        return copy.deepcopy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and any(fields.values()):
+        result = {}
+        for field in fields:
+            if not fields[field]:
+                continue
+            head, *rest = field.split(".")
+            if head not in doc:
+                continue
+            value = _include_path(doc[head], rest)
+            if value is _MISSING:
+                continue
+            if rest and isinstance(result.get(head), list):
+                # Two paths into the same array: merge element-wise
+                result[head] = [{**a, **b} for a, b in zip(result[head], value)]
+            elif rest and isinstance(result.get(head), dict):
+                result[head] = {**result[head], **value}
+            else:
+                result[head] = value
+        if include_id and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+
+    result = {k: copy.deepcopy(v) for k, v in doc.items() if k not in fields}
+    if not include_id:
+        result.pop("_id", None)
+    return result
+
+
+# ============================================
+# CURSOR
+# ============================================
+
+class FakeCursor:
+    """Lazy find() cursor, evaluated on first iteration or to_list()"""
+
+    def __init__(self, collection: "FakeCollection", query: dict | None, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: list = []
+        self._skip = 0
+        self._limit = 0
+        self._results: list | None = None
+
+    def sort(self, key_or_list, direction: int = 1):
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction)]
+        else:
+            self._sort = list(key_or_list)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def _evaluate(self) -> list:
+        if self._results is None:
+            docs = self._collection._match_all(self._query, self._sort)
+            docs = docs[self._skip:]
+            if self._limit:
+                docs = docs[:abs(self._limit)]
+            self._results = [project(doc, self._projection) for doc in docs]
+        return self._results
+
+    async def to_list(self, length: int | None = None) -> list:
+        await self._collection._database._io()
+        docs = self._evaluate()
+        result = docs[:length] if length else list(docs)
+        self._results = docs[len(result):]
+        return result
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._results is None:
+            await self._collection._database._io()
+        docs = self._evaluate()
+        if not docs:
+            raise StopAsyncIteration
+        return docs.pop(0)
+
+
+# ============================================
+# COLLECTION / DATABASE / CLIENT
+# ============================================
+
+class FakeCollection:
+    def __init__(self, database: "FakeDatabase", name: str):
+        self._database = database
+        self.name = name
+        self._docs: dict = {}  # _id -> document, insertion ordered
+        self._indexes: dict = {"_id_": {"key": [("_id", 1)], "unique": True}}
+        self._unique: dict = {}  # unique index name -> {key: _id}
+
+    # ---------- internals ----------
+
+    def _match_all(self, query: dict | None, sort: list | None = None) -> list:
+        if query and set(query) == {"_id"} and not isinstance(query["_id"], dict):
+            doc = self._docs.get(query["_id"])
+            docs = [doc] if doc is not None else []
+        else:
+            docs = [doc for doc in self._docs.values() if matches(doc, query)]
+        for field, direction in reversed(sort or []):
+            docs.sort(key=lambda d: _sort_key(_get_path(d, field)), reverse=direction < 0)
+        return docs
+
+    def _index_key(self, name: str, doc: dict):
+        values = [_missing_to_none(_get_path(doc, f)) for f, _ in self._indexes[name]["key"]]
+        return repr([_sort_key(v) for v in values]), values
+
+    def _indexed(self, name: str, doc: dict) -> bool:
+        """Is doc covered by the index (partial indexes only cover matching docs)"""
+        return matches(doc, self._indexes[name].get("partialFilterExpression"))
+
+    def _store(self, doc: dict, old: dict | None = None):
+        """Write doc (replacing old), keeping unique indexes consistent"""
+        if old is None and doc["_id"] in self._docs:
+            self._raise_duplicate("_id_", {"_id": doc["_id"]})
+        keys = {}
+        for name, entries in self._unique.items():
+            if not self._indexed(name, doc):
+                continue
+            key, values = self._index_key(name, doc)
+            owner = entries.get(key, _MISSING)
+            if owner is not _MISSING and (old is None or owner != old["_id"]):
+                fields = [f for f, _ in self._indexes[name]["key"]]
+                self._raise_duplicate(name, dict(zip(fields, values)))
+            keys[name] = key
+        if old is not None:
+            self._forget(old)
+        for name, key in keys.items():
+            self._unique[name][key] = doc["_id"]
+        self._docs[doc["_id"]] = doc
+
+    def _forget(self, doc: dict):
+        for name, entries in self._unique.items():
+            key = self._index_key(name, doc)[0]
+            if entries.get(key) == doc["_id"]:
+                del entries[key]
+
+    def _delete(self, docs: list):
+        for doc in docs:
+            self._forget(doc)
+            del self._docs[doc["_id"]]
+
+    def _raise_duplicate(self, index_name: str, key: dict):
+        message = f"E11000 duplicate key error collection: {self._database.name}.{self.name} " \
+                  f"index: {index_name} dup key: {key}"
+        raise DuplicateKeyError(message, 11000, {"code": 11000, "errmsg": message, "keyValue": key})
+
+    def _insert(self, document: dict):
+        doc = copy.deepcopy(document)
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+            document["_id"] = doc["_id"]  # pymongo sets _id on the caller's dict too
+        self._store(doc)
+        return doc["_id"]
+
+    def _update(self, query: dict, update, upsert: bool, multi: bool, sort=None) -> tuple:
+        """Returns (matched, modified, upserted_id, [(before, after)])"""
+        targets = self._match_all(query, sort)
+        if not multi:
+            targets = targets[:1]
+
+        changes = []
+        modified = 0
+        for before in targets:
+            after = apply_update(before, update)
+            if after.get("_id") != before["_id"]:
+                raise OperationFailure("fake_db: the _id field is immutable")
+            if after != before:
+                self._store(after, old=before)
+                modified += 1
+            changes.append((before, after))
+
+        if targets or not upsert:
+            return len(targets), modified, None, changes
+
+        after = apply_update(_upsert_seed(query), update, inserting=True)
+        after.setdefault("_id", ObjectId())
+        self._store(after)
+        return 0, 0, after["_id"], [(None, after)]
+
+    # ---------- reads ----------
+
+    def find(self, filter: dict | None = None, projection=None, sort=None, limit: int = 0, skip: int = 0):
+        cursor = FakeCursor(self, filter, projection).skip(skip).limit(limit)
+        if sort:
+            cursor.sort(sort)
+        return cursor
+
+    async def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        await self._database._io()
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        docs = self._match_all(filter, sort)
+        return project(docs[0], projection) if docs else None
+
+    async def count_documents(self, filter: dict, **kwargs) -> int:
+        await self._database._io()
+        return len(self._match_all(filter))
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        await self._database._io()
+        return len(self._docs)
+
+    async def distinct(self, key: str, filter: dict | None = None, **kwargs) -> list:
+        await self._database._io()
+        values = []
+        for doc in self._match_all(filter):
+            value = _get_path(doc, key)
+            for v in value if isinstance(value, list) else [value]:
+                if v is not _MISSING and not any(_compare(v, seen) == 0 for seen in values):
+                    values.append(v)
+        return values
+
+    # ---------- writes ----------
+
+    async def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        await self._database._io()
+        return InsertOneResult(self._insert(document), True)
+
+    async def insert_many(self, documents: list, ordered: bool = True, **kwargs) -> InsertManyResult:
+        await self._database._io()
+        inserted, errors = [], []
+        for i, document in enumerate(documents):
+            try:
+                inserted.append(self._insert(document))
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e), "op": document})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [], "nInserted": len(inserted),
+                "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+            })
+        return InsertManyResult(inserted, True)
+
+    async def update_one(self, filter: dict, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        await self._database._io()
+        return self._update_result(*self._update(filter, update, upsert, multi=False, sort=kwargs.get("sort")))
+
+    async def update_many(self, filter: dict, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        await self._database._io()
+        return self._update_result(*self._update(filter, update, upsert, multi=True))
+
+    @staticmethod
+    def _update_result(matched, modified, upserted_id, changes) -> UpdateResult:
+        raw = {"n": matched or (1 if upserted_id is not None else 0), "nModified": modified, "ok": 1.0,
+               "updatedExisting": bool(matched)}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+
+    async def find_one_and_update(self, filter: dict, update, projection=None, sort=None, upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE, **kwargs):
+        await self._database._io()
+        _, _, _, changes = self._update(filter, update, upsert, multi=False, sort=sort)
+        if not changes:
+            return None
+        before, after = changes[0]
+        doc = after if return_document == ReturnDocument.AFTER else before
+        return project(doc, projection) if doc is not None else None
+
+    async def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        await self._database._io()
+        docs = self._match_all(filter)[:1]
+        self._delete(docs)
+        return DeleteResult({"n": len(docs), "ok": 1.0}, True)
+
+    async def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        await self._database._io()
+        docs = self._match_all(filter)
+        self._delete(docs)
+        return DeleteResult({"n": len(docs), "ok": 1.0}, True)
+
+    async def bulk_write(self, requests: list, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        await self._database._io()
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+                  "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        for i, op in enumerate(requests):
+            try:
+                if isinstance(op, InsertOne):
+                    self._insert(op._doc)
+                    result["nInserted"] += 1
+                elif isinstance(op, (UpdateOne, UpdateMany)):
+                    matched, modified, upserted_id, _ = self._update(
+                        op._filter, op._doc, bool(op._upsert), multi=isinstance(op, UpdateMany))
+                    result["nMatched"] += matched
+                    result["nModified"] += modified
+                    if upserted_id is not None:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": i, "_id": upserted_id})
+                elif isinstance(op, (DeleteOne, DeleteMany)):
+                    docs = self._match_all(op._filter)
+                    if isinstance(op, DeleteOne):
+                        docs = docs[:1]
+                    self._delete(docs)
+                    result["nRemoved"] += len(docs)
+                else:
+                    raise OperationFailure(f"fake_db: unsupported bulk operation {type(op).__name__}")
+            except DuplicateKeyError as e:
+                result["writeErrors"].append({"index": i, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    # ---------- indexes ----------
+
+    async def create_index(self, keys, name: str | None = None, unique: bool = False, **kwargs) -> str:
+        await self._database._io()
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        keys = list(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        if name in self._indexes:
+            return name
+        self._indexes[name] = {"key": keys, "unique": unique, **kwargs}
+        if unique:
+            entries = self._unique[name] = {}
+            for doc in self._docs.values():
+                if not self._indexed(name, doc):
+                    continue
+                key, values = self._index_key(name, doc)
+                if key in entries:
+                    del self._indexes[name], self._unique[name]
+                    self._raise_duplicate(name, dict(zip([f for f, _ in keys], values)))
+                entries[key] = doc["_id"]
+        return name
+
+    async def index_information(self) -> dict:
+        await self._database._io()
+        return copy.deepcopy(self._indexes) if self._docs or len(self._indexes) > 1 else {}
+
+    async def drop_index(self, name: str):
+        await self._database._io()
+        self._indexes.pop(name, None)
+        self._unique.pop(name, None)
+
+    async def drop(self):
+        await self._database._io()
+        self._docs.clear()
+        self._indexes = {"_id_": {"key": [("_id", 1)], "unique": True}}
+        self._unique = {}
+
+
+class FakeDatabase:
+    """Dict of FakeCollections, reachable as attributes like a Motor database"""
+
+    def __init__(self, name: str, latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self._collections: dict = {}
+
+    async def _io(self):
+        # Yield to the event loop like a network round trip would (optionally with latency)
+        await asyncio.sleep(self.latency)
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, **kwargs) -> FakeCollection:
+        return self[name]
+
+    async def list_collection_names(self, **kwargs) -> list:
+        return [name for name, coll in self._collections.items() if coll._docs]
+
+    async def drop_collection(self, name: str):
+        await self[name].drop()
+
+    async def command(self, command, **kwargs) -> dict:
+        if command in ("ping", {"ping": 1}):
+            return {"ok": 1.0}
+        raise OperationFailure(f"fake_db: unsupported command {command}")
+
+
+class FakeMongoClient:
+    """
+    Drop-in for AsyncIOMotorClient backed by process memory
+
+    Args:
+        latency: Seconds to sleep per operation, to simulate a network hop
+    """
+
+    def __init__(self, *args, latency: float = 0.0, **kwargs):
+        self.latency = latency
+        self._databases: dict = {}
+
+    def __getitem__(self, name: str) -> FakeDatabase:
+        if name not in self._databases:
+            self._databases[name] = FakeDatabase(name, self.latency)
+        return self._databases[name]
+
+    def __getattr__(self, name: str) -> FakeDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name: str, **kwargs) -> FakeDatabase:
+        return self[name]
+
+    def close(self):
+        pass
@@ -0,0 +1,168 @@
+"""
+Declarative registry of every MongoDB index the API relies on
+
+Usage:
+    python indexes.py           # create anything missing
+    python indexes.py --check   # only report missing indexes (exit 1 if any)
+
+On startup the app creates missing indexes, or with
+INDEX_AUTO_CREATE=false (databases whose indexes are managed elsewhere)
+only reports them.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from chat_storage import CHAT_BUCKET_SIZE
+from metrics import metrics
+
+load_dotenv()
+
+INDEX_AUTO_CREATE = os.getenv("INDEX_AUTO_CREATE", "true").lower() == "true"
+
+
+class IndexSpec:
+    """One index: collection, key pattern, name and create_index options"""
+
+    def __init__(self, collection: str, keys: list, name: str, reason: str, **options):
+        self.collection = collection
+        self.keys = keys
+        self.name = name
+        self.reason = reason
+        self.options = options
+
+    def __repr__(self):
+        return f"{self.collection}.{self.name}"
+
+
+INDEXES = [
+    # users: login and every authenticated request look users up by email
+    IndexSpec("users", [("email", ASCENDING)], "email_unique",
+              "authenticate_user / get_current_user lookups, duplicate signups", unique=True),
+
+    # user_progress: candidate scans of the daily progress job
+    IndexSpec("user_progress", [("last_active_date", ASCENDING)], "last_active_date",
+              "progress job streak breaks"),
+    IndexSpec("user_progress", [("mode", ASCENDING), ("locked_in_evaluated_on", ASCENDING)], "mode_evaluated_on",
+              "progress job locked-in penalties and weekly resets"),
+    # ...and of the session expiry rebuild (active sessions ordered by deadline)
+    IndexSpec("user_progress", [("locked_in_active", ASCENDING), ("locked_in_deadline", ASCENDING)],
+              "active_deadline", "session expiry heap rebuild and backfill"),
+
+    # chat_logs: history pages are range scans on (user_id, timestamp, _id)
+    IndexSpec("chat_logs", [("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+              "user_timestamp_id", "chat history / export / logs sorted by timestamp"),
+    IndexSpec("chat_logs", [("timestamp", ASCENDING)], "timestamp",
+              "compaction: users with messages older than the cutoff"),
+
+    # chat_log_buckets: open-bucket appends and bucket history reads
+    IndexSpec("chat_log_buckets", [("user_id", ASCENDING), ("start", DESCENDING)],
+              "user_start", "bucket appends and bucketed history reads"),
+    # One open bucket per user and window. The size is part of the filter
+    # (a full bucket is no longer open), so it's part of the name too
+    IndexSpec("chat_log_buckets", [("user_id", ASCENDING), ("window", ASCENDING)],
+              f"user_window_open_{CHAT_BUCKET_SIZE}", "concurrent appends can't open two buckets",
+              unique=True, partialFilterExpression={"open": True, "count": {"$lt": CHAT_BUCKET_SIZE}}),
+    IndexSpec("chat_log_buckets", [("user_id", ASCENDING), ("end", DESCENDING), ("_id", DESCENDING)],
+              "user_end", "newest-first bucketed history pages (walk buckets by end)"),
+    IndexSpec("chat_log_buckets", [("end", ASCENDING)], "end",
+              "compaction: users with buckets that ended before the cutoff"),
+
+    # chat_logs_archive: read-through history and TTL expiry
+    IndexSpec("chat_logs_archive", [("user_id", ASCENDING), ("start", DESCENDING)],
+              "user_start", "archived history reads"),
+    IndexSpec("chat_logs_archive", [("user_id", ASCENDING), ("end", DESCENDING), ("_id", DESCENDING)],
+              "user_end", "newest-first archived history pages"),
+    IndexSpec("chat_logs_archive", [("expires_at", ASCENDING)], "expires_at_ttl",
+              "archive retention (docs without expires_at are kept)", expireAfterSeconds=0),
+
+    # revoked_tokens: revocation filter sync and TTL expiry
+    IndexSpec("revoked_tokens", [("revoked_at", ASCENDING)], "revoked_at",
+              "incremental revocation filter sync"),
+    IndexSpec("revoked_tokens", [("expires_at", ASCENDING)], "expires_at_ttl",
+              "drop revocations once the token has expired anyway", expireAfterSeconds=0),
+
+    # job_runs: one document per scheduled run, claimed by a single worker
+    IndexSpec("job_runs", [("expires_at", ASCENDING)], "expires_at_ttl",
+              "drop old job run records", expireAfterSeconds=0),
+
+    # rate_limits: idle buckets (RATE_LIMIT_STORAGE=mongo)
+    IndexSpec("rate_limits", [("expires_at", ASCENDING)], "expires_at_ttl",
+              "drop idle rate limit buckets", expireAfterSeconds=0),
+]
+
+
+async def find_missing_indexes(db, specs: list = INDEXES) -> list:
+    """
+    Compare the registry against the database
+
+    Returns:
+        list: IndexSpecs with no index of the same name and key pattern
+    """
+    missing = []
+    existing = {}
+    for spec in specs:
+        if spec.collection not in existing:
+            info = await db[spec.collection].index_information()
+            existing[spec.collection] = {name: list(idx["key"]) for name, idx in info.items()}
+        keys = existing[spec.collection].get(spec.name)
+        if keys is None or [(k, int(d)) for k, d in keys] != [(k, int(d)) for k, d in spec.keys]:
+            missing.append(spec)
+    return missing
+
+
+async def ensure_indexes(db, specs: list = INDEXES, create: bool = INDEX_AUTO_CREATE) -> list:
+    """
+    Create missing indexes (or just report them when create=False)
+
+    Returns:
+        list: IndexSpecs that are still missing afterwards
+    """
+    missing = await find_missing_indexes(db, specs)
+    still_missing = []
+
+    for spec in missing:
+        if not create:
+            print(f"⚠️ Missing index {spec} on {spec.keys} ({spec.reason})")
+            still_missing.append(spec)
+            continue
+        try:
+            await db[spec.collection].create_index(spec.keys, name=spec.name, **spec.options)
+            print(f"Created index {spec}")
+        except OperationFailure as e:
+            print(f"⚠️ Could not create index {spec}: {e}")
+            still_missing.append(spec)
+
+    metrics.set_gauge("indexes_missing", len(still_missing))
+    return still_missing
+
+
+def indexes_for(*collections: str) -> list:
+    return [spec for spec in INDEXES if spec.collection in collections]
+
+
+async def _main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from database import MONGODB_URL, DATABASE_NAME
+
+    parser = argparse.ArgumentParser(description="Create or check the API's MongoDB indexes")
+    parser.add_argument("--check", action="store_true", help="only report missing indexes")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(MONGODB_URL)
+    try:
+        missing = await ensure_indexes(client[DATABASE_NAME], create=not args.check)
+    finally:
+        client.close()
+
+    print(f"{len(INDEXES) - len(missing)}/{len(INDEXES)} indexes in place")
+    if missing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
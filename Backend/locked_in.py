@@ -1,56 +1,154 @@
-from datetime import date, timedelta
+import os
+from datetime import date
+from dotenv import load_dotenv
+from metrics import metrics
+from user_repository import CONTEXT, find_user, find_and_update_user, encode_day, stored_day
+
+load_dotenv()
+
+# Configuration
+LOCKED_IN_MEMO_MAX_SIZE = int(os.getenv("LOCKED_IN_MEMO_MAX_SIZE", 100000))
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+
+def locked_in_update_stages(today: date) -> list:
+    """
+    Pipeline-update stages doing update_locked_in_status server-side
+
+    Same rules, evaluated inside one update so callers can fold them into
+    a single atomic write: Monday weekly reset, first locked-in day, and
+    missed days -> penalty 2 ** missed_days. Users not in locked_in mode
+    are left untouched.
+
+    Args:
+        today: The day to evaluate for
+
+    Returns:
+        list: Stages for an update pipeline
+    """
+    today_dt = encode_day(today)
+    locked_in = {"$eq": ["$mode", "locked_in"]}
+
+    # Weekly reset every Monday (once)
+    if today.weekday() == 0:
+        reset = {"$and": [locked_in, {"$ne": [stored_day("weekly_reset_date"), today_dt]}]}
+        return [{"$set": {
+            "missed_days": {"$cond": [reset, 0, "$missed_days"]},
+            "penalty_remaining": {"$cond": [reset, 0, "$penalty_remaining"]},
+            "weekly_reset_date": {"$cond": [reset, today_dt, "$weekly_reset_date"]},
+        }}]
+
+    has_last_date = {"$ne": [{"$ifNull": ["$last_coding_date", None]}, None]}
+
+    return [
+        # Days missed since the last coding day (0 when nothing was missed)
+        {"$set": {"_missed": {"$cond": [
+            {"$and": [locked_in, has_last_date]},
+            {"$max": [0, {"$subtract": [
+                {"$floor": {"$divide": [
+                    {"$subtract": [today_dt, stored_day("last_coding_date")]},
+                    MS_PER_DAY,
+                ]}},
+                1,
+            ]}]},
+            0,
+        ]}}},
+        {"$set": {
+            "missed_days": {"$cond": [
+                {"$gt": ["$_missed", 0]},
+                {"$add": [{"$ifNull": ["$missed_days", 0]}, "$_missed"]},
+                "$missed_days",
+            ]},
+            "last_coding_date": {"$cond": [
+                {"$and": [locked_in, {"$or": [{"$not": [has_last_date]}, {"$gt": ["$_missed", 0]}]}]},
+                today_dt,
+                "$last_coding_date",
+            ]},
+        }},
+        {"$set": {"penalty_remaining": {"$cond": [
+            {"$gt": ["$_missed", 0]},
+            {"$pow": [2, "$missed_days"]},
+            "$penalty_remaining",
+        ]}}},
+        {"$unset": "_missed"},
+    ]
+
+
+def locked_in_evaluation_stages(today: date) -> list:
+    """
+    locked_in_update_stages plus the locked_in_evaluated_on marker
+
+    The marker is only set for locked-in users, so switching to locked-in
+    mode later in the day still gets evaluated.
+    """
+    locked_in = {"$eq": ["$mode", "locked_in"]}
+    return [
+        *locked_in_update_stages(today),
+        {"$set": {"locked_in_evaluated_on": {"$cond": [
+            locked_in, encode_day(today), "$locked_in_evaluated_on",
+        ]}}},
+    ]
+
+
+class DailyMemo:
+    """Ids of users already evaluated today in this process, forgotten when the day changes"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._day: date | None = None
+        self._ids: set = set()
+
+    def _roll(self, today: date):
+        if today != self._day:
+            self._day = today
+            self._ids = set()
+
+    def seen(self, user_id, today: date) -> bool:
+        self._roll(today)
+        return user_id in self._ids
+
+    def add(self, user_id, today: date):
+        self._roll(today)
+        if len(self._ids) >= self.max_size:
+            self._ids.clear()
+        self._ids.add(user_id)
+
+
+locked_in_memo = DailyMemo(max_size=LOCKED_IN_MEMO_MAX_SIZE)
+
 
 async def update_locked_in_status(db , user: dict) -> dict:
-    """Update missed days + penalties for locked-in mode."""
+    """
+    Update missed days + penalties for locked-in mode, at most once per user per day
+
+    Skipped when the user's locked_in_evaluated_on is today (set by an
+    earlier call, the login pipeline or the daily progress job) or when
+    this process already evaluated them today. Otherwise the rules run as
+    one conditional pipeline update, so concurrent first calls of the day
+    evaluate only once.
+    """
 
     # Only apply logic if locked_in_mode
     if user.get("mode") != "locked_in":
         return user  # Nothing to do
 
     today = date.today()
-    today_str = today.isoformat()
-
-    last_date_str = user.get("last_coding_date")
-    weekly_reset_date_str = user.get("weekly_reset_date")
-
-    # Weekly reset every Monday
-    if today.weekday() == 0:  # Monday = 0
-        #Only run reset once a week, on monday that is
-        if weekly_reset_date_str != today_str:
-            await db.users.update_one(
-                {"_id": user["_id"]},
-                {"$set": {
-                    "missed_days": 0,
-                    "penalty_remaining": 0,
-                    "weekly_reset_date": today_str
-                }}
-            )
-        return await db.users.find_one({"_id": user["_id"]})
-
-    # First-ever day using locked in mode
-    if last_date_str is None:
-        await db.users.update_one(
-            {"_id": user["_id"]},
-            {"$set": {"last_coding_date": today_str}}
-        )
-        return await db.users.find_one({"_id": user["_id"]})
-
-    # Calculate missed days
-    last_date = date.fromisoformat(last_date_str)
-    delta = (today - last_date).days
-
-    if delta > 1:
-        missed = delta - 1
-        new_missed = user.get("missed_days", 0) + missed
-        new_penalty = 2 ** new_missed
-
-        await db.users.update_one(
-            {"_id": user["_id"]},
-            {"$set": {
-                "missed_days": new_missed,
-                "penalty_remaining": new_penalty,
-                "last_coding_date": today_str
-            }}
-        )
-    
-    return await db.users.find_one({"_id": user["_id"]})
+
+    if user.get("locked_in_evaluated_on") == today or locked_in_memo.seen(user["_id"], today):
+        metrics.inc("locked_in_evaluation_skipped")
+        return user
+
+    updated_user = await find_and_update_user(
+        db, user,
+        locked_in_evaluation_stages(today),
+        CONTEXT,
+        query={"locked_in_evaluated_on": {"$ne": encode_day(today)}}
+    )
+    locked_in_memo.add(user["_id"], today)
+    metrics.inc("locked_in_evaluation_run")
+
+    if updated_user is None:
+        # Another request evaluated them first
+        return await find_user(db, user["_id"], CONTEXT)
+    return updated_user
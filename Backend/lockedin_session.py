@@ -2,6 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException
 from datetime import datetime, date
 from database import get_database
 from auth import get_current_user
+from user_repository import update_user, encode_day
+from session_expiry import session_expiry, session_deadline, fail_session_stages
 
 router = APIRouter()
 
@@ -16,17 +18,23 @@ async def start_locked_in_session(
     if problems_required <= 0:
         raise HTTPException(status_code=400, detail="Problems required must be > 0")
 
-    await db.users.update_one(
-        {"_id": current_user["_id"]},
+    started_at = datetime.utcnow()
+    deadline = session_deadline(started_at, time_limit)
+
+    await update_user(
+        db, current_user,
         {"$set": {
             "mode": "locked_in",
             "locked_in_active": True,
             "locked_in_problems_required": problems_required,
             "locked_in_problems_completed": 0,
-            "locked_in_started_at": datetime.utcnow().isoformat(),
-            "locked_in_time_limit": time_limit
+            "locked_in_started_at": started_at,
+            "locked_in_time_limit": time_limit,
+            "locked_in_deadline": deadline
         }}
     )
+    # Fails the session when time runs out (time_limit is in minutes, 0 = none)
+    session_expiry.schedule(current_user["_id"], deadline)
 
     return {"message": "Locked-In session started"}
 
@@ -44,28 +52,29 @@ async def update_progress(
 
     new_completed = user.get("locked_in_problems_completed", 0) + solved
 
-    await db.users.update_one(
-        {"_id": user["_id"]},
+    await update_user(
+        db, user,
         {"$set": {"locked_in_problems_completed": new_completed}}
     )
 
-    today_str = date.today().isoformat()
+    today = encode_day(date.today())
 
-    await db.users.update_one(
-        {"_id": user["_id"]},
+    await update_user(
+        db, user,
         {"$set": {
             "locked_in_problems_completed": new_completed,
-            "last_coding_date": today_str  
+            "last_coding_date": today
         }}
     )
 
     # Check if session completed
     if new_completed >= user.get("locked_in_problems_required", 0):
-        await db.users.update_one(
-            {"_id": user["_id"]},
+        await update_user(
+            db, user,
             {"$set": {
                 "locked_in_active": False,
-                "mode": "casual"
+                "mode": "casual",
+                "locked_in_deadline": None
             }}
         )
         return {"message": "Session complete!"}
@@ -83,20 +92,9 @@ async def fail_session(
     if not user.get("locked_in_active"):
         raise HTTPException(status_code=400, detail="No active session.")
 
-    # Apply penalty
-    penalty = user.get("penalty_remaining", 0)
-
-    await db.users.update_one(
-        {"_id": user["_id"]},
-        {"$set": {
-            "xp": max(0, user.get("xp", 0) - penalty),
-            "locked_in_active": False,
-            "mode": "casual",
-            "locked_in_problems_required": 0,
-            "locked_in_problems_completed": 0,
-            "locked_in_started_at": None,
-            "locked_in_time_limit": 0
-        }}
-    )
+    # Apply penalty (same update as a session running out of time)
+    result = await update_user(db, user, fail_session_stages(), query={"locked_in_active": True})
+    if not result.matched_count:
+        raise HTTPException(status_code=400, detail="No active session.")
 
     return {"message": "Session failed. Penalty applied."}
@@ -2,12 +2,20 @@ from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordRequestForm
 from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timedelta
-from database import connect_to_mongo, close_mongo_connection, get_database
+from contextlib import asynccontextmanager
+from database import mongo_lifespan
 from schemas import UserResponse
 from fastapi.middleware.cors import CORSMiddleware
-from auth import router as auth_router  
+from auth import router as auth_router
 from streaks import router as streak_router 
 from ai_chat import router as ai_chat_router
+from chat_log_writer import chat_log_writer
+from metrics import metrics
+from refresh_tokens import revocation_filter
+from indexes import ensure_indexes
+from progress_job import progress_job_scheduler
+from session_expiry import session_expiry
+from lockedin_session import router as lockedin_router
 
 
 import os
@@ -15,7 +23,28 @@ import uvicorn
 
 
 
-app = FastAPI(title="User Authentication API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup and shutdown: Mongo client, indexes and background workers"""
+    async with mongo_lifespan() as db:
+        print("Connected to MongoDB Atlas! yay!")
+        await ensure_indexes(db)
+        await chat_log_writer.start(db)
+        await revocation_filter.start(db)
+        await progress_job_scheduler.start(db)
+        await session_expiry.start(db)
+
+        yield
+
+        # Flush buffered chat logs before the connection goes away
+        await chat_log_writer.stop()
+        await revocation_filter.stop()
+        await progress_job_scheduler.stop()
+        await session_expiry.stop()
+    print("Closed MongoDB connection! Yay!")
+
+
+app = FastAPI(title="User Authentication API", lifespan=lifespan)
 
 origins = [
     "http://localhost:5173", # Vite (React) default port
@@ -34,6 +63,7 @@ app.add_middleware(
 
 app.include_router(streak_router)
 app.include_router(ai_chat_router)
+app.include_router(lockedin_router)
 
 @app.get("/", tags=["Root"])
 async def root():
@@ -46,23 +76,19 @@ async def root():
             "register": "POST /auth/register",
             "login_json": "POST /auth/login",
             "login_form": "POST /auth/token",
+            "refresh": "POST /auth/refresh",
+            "logout": "POST /auth/logout",
             "current_user": "GET /auth/me",
-            "protected": "GET /auth/protected"
+            "protected": "GET /auth/protected",
+            "chat_history": "GET /auth/chat/history",
+            "chat_export": "GET /auth/chat/export",
+            "lockedin_start": "POST /lockedin/start",
+            "lockedin_progress": "POST /lockedin/progress",
+            "lockedin_fail": "POST /lockedin/fail"
         }
     }
 
 
-# Startup and shutdown events
-@app.on_event("startup")
-async def startup_db_client():
-    await connect_to_mongo()
-    print("Connected to MongoDB Atlas! yay!")
-    
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    await close_mongo_connection()
-    print("Closed MongoDB connection! Yay!")
-
 # Public routes
 # Include routers
 app.include_router(auth_router)
@@ -75,6 +101,11 @@ async def health_check():
     """Check if API is running"""
     return {"status": "healthy", "message": "API is running"}
 
+@app.get("/metrics", tags=["Health"])
+async def get_metrics():
+    """In-process counters, gauges and timers for this worker"""
+    return metrics.snapshot()
+
 # Run the application
 if __name__ == "__main__":
     
@@ -0,0 +1,49 @@
+import threading
+import time
+
+
+class Metrics:
+    """
+    Tiny in-process metrics registry
+
+    Counters, gauges and timers (count / total / max seconds) kept in plain
+    dicts and exposed as JSON on GET /metrics. Per worker process only.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[str, int] = {}
+        self.gauges: dict[str, float] = {}
+        self.timers: dict[str, dict] = {}
+        self.started_at = time.time()
+
+    def inc(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            timer = self.timers.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            timer["count"] += 1
+            timer["total"] += seconds
+            timer["max"] = max(timer["max"], seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            timers = {
+                name: {**t, "avg": t["total"] / t["count"] if t["count"] else 0.0}
+                for name, t in self.timers.items()
+            }
+            return {
+                "uptime_seconds": time.time() - self.started_at,
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "timers": timers,
+            }
+
+
+metrics = Metrics()
@@ -0,0 +1,106 @@
+"""
+One-shot migration of user date fields from ISO strings to BSON dates
+(in both users and user_progress)
+
+Usage:
+    python migrate_dates.py              # convert everything
+    python migrate_dates.py --dry-run    # only count what would change
+
+Day fields (last_active_date, last_login_date, last_coding_date,
+weekly_reset_date) become midnight UTC, created_at / locked_in_started_at
+keep their time. Only documents that still hold strings are touched, so
+the tool can be re-run or interrupted safely. The API reads both formats
+(user_repository.decode_dates), so it can run while the app is serving.
+"""
+
+import argparse
+import asyncio
+from pymongo import UpdateOne
+from user_repository import (
+    DAY_FIELDS, TIMESTAMP_FIELDS, USER_PROGRESS, USERS, decode_day, decode_timestamp, encode_day
+)
+
+MIGRATION_BATCH_SIZE = 1000
+
+
+def _converted(doc: dict) -> dict:
+    """$set for the string fields of one document (empty strings become null)"""
+    changes = {}
+    for field in DAY_FIELDS:
+        if isinstance(doc.get(field), str):
+            changes[field] = encode_day(decode_day(doc[field]))
+    for field in TIMESTAMP_FIELDS:
+        if isinstance(doc.get(field), str):
+            changes[field] = decode_timestamp(doc[field])
+    return changes
+
+
+async def migrate_user_dates(db, batch_size: int = MIGRATION_BATCH_SIZE, dry_run: bool = False) -> dict:
+    """
+    Convert string dates to BSON dates in users and user_progress
+
+    Returns:
+        dict: Counts of documents scanned, updated and skipped (unparseable values)
+    """
+    stats = {"scanned": 0, "updated": 0, "skipped": 0}
+    for collection in (USERS, USER_PROGRESS):
+        await _migrate_collection(db[collection], batch_size, dry_run, stats)
+    return stats
+
+
+async def _migrate_collection(collection, batch_size: int, dry_run: bool, stats: dict):
+    """
+    One bulk_write per batch
+
+    Each update is conditioned on the field still being the string that
+    was read, so a concurrent write from the app is never overwritten.
+    """
+    fields = DAY_FIELDS + TIMESTAMP_FIELDS
+    query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    projection = {field: 1 for field in fields}
+
+    async def flush(ops: list):
+        if ops and not dry_run:
+            result = await collection.bulk_write(ops, ordered=False)
+            stats["updated"] += result.modified_count
+        elif ops:
+            stats["updated"] += len(ops)
+
+    ops = []
+    async for doc in collection.find(query, projection).batch_size(batch_size):
+        stats["scanned"] += 1
+        try:
+            changes = _converted(doc)
+        except ValueError as e:
+            print(f"⚠️ Skipping {doc['_id']}: {e}")
+            stats["skipped"] += 1
+            continue
+
+        guard = {field: doc[field] for field in changes}
+        ops.append(UpdateOne({"_id": doc["_id"], **guard}, {"$set": changes}))
+        if len(ops) >= batch_size:
+            await flush(ops)
+            ops = []
+            print(f"Migrated dates for {stats['updated']} {collection.name} documents so far")
+    await flush(ops)
+
+
+async def _main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from database import MONGODB_URL, DATABASE_NAME
+
+    parser = argparse.ArgumentParser(description="Convert user date fields from ISO strings to BSON dates")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="only count documents that would change")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(MONGODB_URL)
+    try:
+        stats = await migrate_user_dates(client[DATABASE_NAME], args.batch_size, args.dry_run)
+        print("Migration done:", stats)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
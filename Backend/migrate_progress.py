@@ -0,0 +1,84 @@
+"""
+Move the progress counters out of users into user_progress
+
+Usage:
+    python migrate_progress.py            # copy counters into user_progress
+    python migrate_progress.py --prune    # ...then remove them from users
+
+Users without a progress document are also migrated lazily the first time
+the API reads or writes their progress, so this can run while the app is
+serving. Only use --prune once every running instance reads from
+user_progress, older code still expects the counters in users.
+"""
+
+import argparse
+import asyncio
+from pymongo import UpdateOne
+from user_repository import HOT_FIELDS, PROGRESS_DEFAULTS, USER_PROGRESS, USERS, split_user_doc
+
+MIGRATION_BATCH_SIZE = 1000
+
+
+async def migrate_user_progress(db, batch_size: int = MIGRATION_BATCH_SIZE, prune: bool = False) -> dict:
+    """
+    Copy embedded counters into user_progress with one bulk_write per batch
+
+    $setOnInsert never overwrites a progress document that already exists
+    (created lazily and possibly updated since), so the copy is idempotent.
+
+    Returns:
+        dict: Counts of users scanned, progress documents created and users pruned
+    """
+    query = {"$or": [{field: {"$exists": True}} for field in HOT_FIELDS]}
+    projection = {field: 1 for field in HOT_FIELDS}
+    stats = {"scanned": 0, "created": 0, "pruned": 0}
+
+    async def flush(user_ids: list, ops: list):
+        if not ops:
+            return
+        result = await db[USER_PROGRESS].bulk_write(ops, ordered=False)
+        stats["created"] += result.upserted_count
+        if prune:
+            # Every user in this batch now has a progress document
+            result = await db[USERS].update_many(
+                {"_id": {"$in": user_ids}},
+                {"$unset": {field: "" for field in HOT_FIELDS}},
+            )
+            stats["pruned"] += result.modified_count
+
+    user_ids, ops = [], []
+    async for doc in db[USERS].find(query, projection).batch_size(batch_size):
+        stats["scanned"] += 1
+        _, progress = split_user_doc({**PROGRESS_DEFAULTS, **doc})
+        progress.pop("_id")
+        user_ids.append(doc["_id"])
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$setOnInsert": progress}, upsert=True))
+        if len(ops) >= batch_size:
+            await flush(user_ids, ops)
+            user_ids, ops = [], []
+            print(f"Migrated progress for {stats['scanned']} users so far")
+    await flush(user_ids, ops)
+
+    return stats
+
+
+async def _main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from database import MONGODB_URL, DATABASE_NAME
+
+    parser = argparse.ArgumentParser(description="Move user progress counters into user_progress")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument("--prune", action="store_true",
+                        help="remove the counters from users once they're copied")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(MONGODB_URL)
+    try:
+        stats = await migrate_user_progress(client[DATABASE_NAME], args.batch_size, args.prune)
+        print("Migration done:", stats)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
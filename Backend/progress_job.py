@@ -0,0 +1,278 @@
+"""
+Daily batch job for streak breaks and locked-in penalties
+
+Usage:
+    python progress_job.py                    # evaluate today
+    python progress_job.py --date 2026-10-19  # evaluate a given day
+    python progress_job.py --force            # even if done or leased elsewhere
+
+Runs once per day (in process shortly after local midnight, or from cron
+through the CLI) and applies, to every affected user_progress document:
+    - streak reset to 0 when the last check-in is older than yesterday
+    - locked_in_evaluation_stages: missed days -> penalty, Monday weekly
+      reset, and the locked_in_evaluated_on marker
+
+Those are the same rules the request path applies lazily, so once the job
+has run, update_locked_in_status skips every locked-in user for the day.
+Candidates come from indexed range queries and are updated with
+bulk_write in chunks. Dates must be native (migrate_dates.py); users still
+holding ISO strings are left to the lazy path.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from locked_in import locked_in_evaluation_stages
+from metrics import metrics
+from user_cache import user_cache
+from user_repository import USER_PROGRESS, encode_day
+
+load_dotenv()
+
+# Configuration
+PROGRESS_JOB_IN_PROCESS = os.getenv("PROGRESS_JOB_IN_PROCESS", "true").lower() == "true"
+PROGRESS_JOB_DELAY_MINUTES = int(os.getenv("PROGRESS_JOB_DELAY_MINUTES", 5))  # after local midnight
+PROGRESS_JOB_CHUNK_SIZE = int(os.getenv("PROGRESS_JOB_CHUNK_SIZE", 500))
+# A run not marked done within this long can be taken over by another worker
+PROGRESS_JOB_LEASE_MINUTES = int(os.getenv("PROGRESS_JOB_LEASE_MINUTES", 30))
+PROGRESS_JOB_RETRY_MINUTES = int(os.getenv("PROGRESS_JOB_RETRY_MINUTES", 5))
+JOB_RUN_RETENTION_DAYS = 30
+
+
+# ============================================
+# JOB
+# ============================================
+
+def streak_break_query(today: date) -> dict:
+    """Users with a running streak who didn't check in yesterday or today"""
+    return {"streak": {"$gt": 0}, "last_active_date": {"$lt": encode_day(today - timedelta(days=1))}}
+
+
+def locked_in_query(today: date) -> dict:
+    """Locked-in users not evaluated yet today"""
+    return {"mode": "locked_in", "locked_in_evaluated_on": {"$ne": encode_day(today)}}
+
+
+async def _update_in_chunks(db, query: dict, update, chunk_size: int) -> int:
+    """
+    Apply update to every document matching query, chunk_size per bulk_write
+
+    Each UpdateOne repeats the query, so users who changed since they were
+    listed (checked in, left locked-in mode) are skipped.
+
+    Returns:
+        int: Documents modified
+    """
+    collection = db[USER_PROGRESS]
+    modified = 0
+    ops = []
+
+    async for doc in collection.find(query, {"_id": 1}).batch_size(chunk_size):
+        ops.append(UpdateOne({"_id": doc["_id"], **query}, update))
+        if len(ops) >= chunk_size:
+            modified += (await collection.bulk_write(ops, ordered=False)).modified_count
+            ops = []
+    if ops:
+        modified += (await collection.bulk_write(ops, ordered=False)).modified_count
+
+    return modified
+
+
+async def run_progress_job(db, today: date | None = None, chunk_size: int = PROGRESS_JOB_CHUNK_SIZE) -> dict:
+    """
+    Apply streak breaks and locked-in penalties for one day
+
+    Idempotent: a second run on the same day matches nothing.
+
+    Returns:
+        dict: Number of streaks broken and locked-in users updated
+    """
+    today = today or date.today()
+    started = time.perf_counter()
+
+    stats = {
+        "streaks_broken": await _update_in_chunks(
+            db, streak_break_query(today), {"$set": {"streak": 0}}, chunk_size),
+        "locked_in_updated": await _update_in_chunks(
+            db, locked_in_query(today), locked_in_evaluation_stages(today), chunk_size),
+    }
+
+    metrics.observe("progress_job_seconds", time.perf_counter() - started)
+    metrics.set_gauge("progress_job_streaks_broken", stats["streaks_broken"])
+    metrics.set_gauge("progress_job_locked_in_updated", stats["locked_in_updated"])
+    print(f"Progress job for {today}: {stats}")
+    return stats
+
+
+def _run_id(today: date) -> str:
+    return f"progress:{today.isoformat()}"
+
+
+async def claim_run(db, today: date, lease_minutes: int = PROGRESS_JOB_LEASE_MINUTES) -> bool:
+    """
+    Take the lease on today's run, False if it's done or another worker holds it
+
+    job_runs documents go from running (with lease_expires_at) to done. A
+    running lease that expired (failed run, worker died mid-run) can be
+    taken over; the updates are idempotent so redoing part of a day is safe.
+    """
+    now = datetime.utcnow()
+    try:
+        # Upsert: inserts the first claim, takes over an expired lease, and
+        # raises DuplicateKeyError when the run is done or still leased
+        await db.job_runs.update_one(
+            {"_id": _run_id(today), "status": "running", "lease_expires_at": {"$lte": now}},
+            {
+                "$set": {
+                    "status": "running",
+                    "started_at": now,
+                    "lease_expires_at": now + timedelta(minutes=lease_minutes),
+                    "expires_at": now + timedelta(days=JOB_RUN_RETENTION_DAYS),
+                },
+                "$inc": {"attempts": 1},
+            },
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def complete_run(db, today: date):
+    """Mark today's run done, no worker will run it again"""
+    await db.job_runs.update_one(
+        {"_id": _run_id(today)},
+        {"$set": {"status": "done", "finished_at": datetime.utcnow()}, "$unset": {"lease_expires_at": ""}},
+    )
+
+
+async def release_run(db, today: date):
+    """Give up the lease after a failed run so it can be retried right away"""
+    await db.job_runs.update_one(
+        {"_id": _run_id(today), "status": "running"},
+        {"$set": {"lease_expires_at": datetime.utcnow()}},
+    )
+
+
+async def run_done(db, today: date) -> bool:
+    return await db.job_runs.find_one({"_id": _run_id(today), "status": "done"}, {"_id": 1}) is not None
+
+
+# ============================================
+# IN-PROCESS SCHEDULER
+# ============================================
+
+class ProgressJobScheduler:
+    """
+    Runs the job once per local day inside the API process
+
+    On start it catches up if today's run is missing, then sleeps until
+    PROGRESS_JOB_DELAY_MINUTES past the next local midnight. Workers
+    race for the job_runs lease so only one of them does the work; until
+    the day is marked done (failed run, lease held by a worker that may
+    die) every worker checks back every retry_minutes.
+    """
+
+    def __init__(self, enabled: bool, delay_minutes: int, chunk_size: int, retry_minutes: int):
+        self.enabled = enabled
+        self.delay_minutes = delay_minutes
+        self.chunk_size = chunk_size
+        self.retry_minutes = retry_minutes
+        self._db = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self, db):
+        if not self.enabled:
+            return
+        self._db = db
+        self._task = asyncio.create_task(self._loop())
+        print(f"Progress job scheduled daily at 00:{self.delay_minutes:02d}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def _seconds_until_next_run(self) -> float:
+        now = datetime.now()
+        next_run = datetime(now.year, now.month, now.day) + timedelta(days=1, minutes=self.delay_minutes)
+        return (next_run - now).total_seconds()
+
+    async def run_once(self) -> bool:
+        """Run today's job if it's ours to run, returns whether the day is done"""
+        today = date.today()
+        if await claim_run(self._db, today):
+            try:
+                await run_progress_job(self._db, today, self.chunk_size)
+            except BaseException:
+                await release_run(self._db, today)
+                raise
+            await complete_run(self._db, today)
+            # Cached users predate the job (other workers catch up within USER_CACHE_TTL_SECONDS)
+            user_cache.clear()
+        return await run_done(self._db, today)
+
+    async def _loop(self):
+        while True:
+            try:
+                done = await self.run_once()
+            except Exception as e:
+                metrics.inc("progress_job_failed")
+                print(f"Progress job failed: {e}")
+                done = False
+            delay = self._seconds_until_next_run()
+            if not done:
+                delay = min(delay, self.retry_minutes * 60)
+            await asyncio.sleep(delay)
+
+
+progress_job_scheduler = ProgressJobScheduler(
+    enabled=PROGRESS_JOB_IN_PROCESS,
+    delay_minutes=PROGRESS_JOB_DELAY_MINUTES,
+    chunk_size=PROGRESS_JOB_CHUNK_SIZE,
+    retry_minutes=PROGRESS_JOB_RETRY_MINUTES,
+)
+
+
+async def _main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from database import MONGODB_URL, DATABASE_NAME
+
+    parser = argparse.ArgumentParser(description="Apply streak breaks and locked-in penalties for a day")
+    parser.add_argument("--date", type=date.fromisoformat, default=None, help="day to evaluate (default today)")
+    parser.add_argument("--chunk-size", type=int, default=PROGRESS_JOB_CHUNK_SIZE)
+    parser.add_argument("--force", action="store_true",
+                        help="run even if the day is done or leased by a worker (job_runs is left alone)")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(MONGODB_URL)
+    try:
+        db = client[DATABASE_NAME]
+        today = args.date or date.today()
+        # Hold the lease while running and mark the day done on success, so
+        # the in-process scheduler neither races nor repeats it
+        claimed = await claim_run(db, today)
+        if not claimed and not args.force:
+            state = "already done" if await run_done(db, today) else "leased by another worker"
+            print(f"Progress job for {today} is {state}, use --force to run it anyway")
+            sys.exit(1)
+        try:
+            await run_progress_job(db, today, args.chunk_size)
+        except BaseException:
+            if claimed:
+                await release_run(db, today)
+            raise
+        if claimed:
+            await complete_run(db, today)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
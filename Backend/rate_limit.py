@@ -0,0 +1,151 @@
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request, status
+from pymongo import ReturnDocument
+from metrics import metrics
+
+load_dotenv()
+
+# Configuration
+# "memory" = per worker process (default), "mongo" = shared by every worker through rate_limits
+RATE_LIMIT_STORAGE = os.getenv("RATE_LIMIT_STORAGE", "memory")
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))  # memory storage only
+
+# (burst capacity, refill per minute)
+LOGIN_IP_LIMIT = (int(os.getenv("LOGIN_IP_BURST", 20)), float(os.getenv("LOGIN_IP_PER_MINUTE", 10)))
+LOGIN_ACCOUNT_LIMIT = (int(os.getenv("LOGIN_ACCOUNT_BURST", 5)), float(os.getenv("LOGIN_ACCOUNT_PER_MINUTE", 2)))
+REGISTER_IP_LIMIT = (int(os.getenv("REGISTER_IP_BURST", 5)), float(os.getenv("REGISTER_IP_PER_MINUTE", 1)))
+
+
+# ============================================
+# STORAGE
+# ============================================
+
+class InMemoryBucketStorage:
+    """Token buckets in a bounded dict, state is local to this worker"""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, db, key: str, capacity: int, per_second: float) -> float:
+        """
+        Take one token from a bucket
+
+        Returns:
+            float: 0 if allowed, otherwise seconds until a token is available
+        """
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * per_second)
+
+        if tokens >= 1:
+            retry_after = 0.0
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / per_second
+
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+
+class MongoBucketStorage:
+    """
+    Token buckets shared by all workers in the rate_limits collection
+
+    Refill and take happen in one atomic pipeline update, so concurrent
+    workers can't both spend the last token. Idle buckets expire through
+    a TTL index on expires_at.
+    """
+
+    async def take(self, db, key: str, capacity: int, per_second: float) -> float:
+        now = datetime.utcnow()
+        # A bucket left alone this long is full again, so it's safe to drop
+        expires_at = now + timedelta(seconds=capacity / per_second)
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+
+        bucket = await db.rate_limits.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {
+                    "tokens": {"$min": [capacity, {"$add": [
+                        {"$ifNull": ["$tokens", capacity]},
+                        {"$multiply": [elapsed, per_second]},
+                    ]}]},
+                    "updated_at": now,
+                    "expires_at": expires_at,
+                }},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+        if bucket["allowed"]:
+            return 0.0
+        return (1 - bucket["tokens"]) / per_second
+
+
+# ============================================
+# LIMITER
+# ============================================
+
+class RateLimiter:
+    """Per-key token buckets on top of a pluggable storage"""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def check(self, db, scope: str, key: str, limit: tuple[int, float]):
+        """
+        Spend one token from the (scope, key) bucket
+
+        Raises:
+            HTTPException: 429 with Retry-After if the bucket is empty
+        """
+        capacity, per_minute = limit
+        if capacity <= 0 or per_minute <= 0:
+            return
+
+        retry_after = await self.storage.take(db, f"{scope}:{key}", capacity, per_minute / 60)
+        if retry_after > 0:
+            metrics.inc(f"rate_limited_{scope}")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many attempts, please slow down",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+
+def client_ip(request: Request) -> str:
+    """Caller's IP (first X-Forwarded-For hop only when running behind a trusted proxy)"""
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def limit_login(request: Request, db, email: str):
+    """Per-IP and per-account buckets, checked before any bcrypt work"""
+    await rate_limiter.check(db, "login_ip", client_ip(request), LOGIN_IP_LIMIT)
+    await rate_limiter.check(db, "login_account", email.lower(), LOGIN_ACCOUNT_LIMIT)
+
+
+async def limit_register(request: Request, db):
+    await rate_limiter.check(db, "register_ip", client_ip(request), REGISTER_IP_LIMIT)
+
+
+rate_limiter = RateLimiter(
+    MongoBucketStorage() if RATE_LIMIT_STORAGE == "mongo"
+    else InMemoryBucketStorage(max_keys=RATE_LIMIT_MAX_KEYS)
+)
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import math
+import os
+import uuid
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from jose import JWTError, jwt
+from pymongo.errors import DuplicateKeyError
+from metrics import metrics
+from utils import SECRET_KEY, ALGORITHM
+
+load_dotenv()
+
+# Configuration
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 14))
+REVOCATION_FILTER_CAPACITY = int(os.getenv("REVOCATION_FILTER_CAPACITY", 100000))
+REVOCATION_FILTER_ERROR_RATE = float(os.getenv("REVOCATION_FILTER_ERROR_RATE", 0.001))
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", 30))  # pick up other workers' revocations
+# Each sync re-reads this far back, revoked_at comes from other workers' clocks
+REVOCATION_SYNC_OVERLAP_SECONDS = float(os.getenv("REVOCATION_SYNC_OVERLAP_SECONDS", 300))
+
+
+# ============================================
+# TOKENS
+# ============================================
+
+def create_refresh_token(email: str) -> str:
+    """
+    Create a long-lived refresh token
+
+    Carries a unique jti so it can be revoked (and rotated) on its own.
+    """
+    expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    to_encode = {"sub": email, "type": "refresh", "jti": uuid.uuid4().hex, "exp": expire}
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_refresh_token(token: str) -> dict | None:
+    """Verify a refresh token, returns None if it's invalid, expired or not a refresh token"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+
+    if payload.get("type") != "refresh" or not payload.get("sub") or not payload.get("jti"):
+        return None
+    return payload
+
+
+# ============================================
+# REVOCATION
+# ============================================
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (no false negatives, rare false positives)"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.sha256(item.encode()).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class RevocationFilter:
+    """
+    Revoked refresh-token ids, held in a Bloom filter backed by Mongo
+
+    revoked_tokens ({_id: jti, revoked_at, expires_at}, TTL on expires_at)
+    is the source of truth. The filter answers "definitely not revoked"
+    in memory for almost every check; only a filter hit goes to Mongo to
+    rule out a false positive. A background loop pulls revocations made
+    by other workers every REVOCATION_SYNC_SECONDS.
+
+    The filter is only a fast path: rotation and logout are enforced by
+    revoke's insert into revoked_tokens, which succeeds once per jti.
+    """
+
+    def __init__(self, capacity: int, error_rate: float, sync_seconds: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_seconds = sync_seconds
+        self.filter = BloomFilter(capacity, error_rate)
+        self._db = None
+        self._synced_until: datetime | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self, db):
+        """Load current revocations and start syncing"""
+        self._db = db
+        await self.rebuild()
+        self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def rebuild(self):
+        """Reload the filter from scratch (also drops ids whose tokens expired)"""
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        synced_until = datetime.utcnow()
+        async for doc in self._db.revoked_tokens.find({"expires_at": {"$gt": synced_until}}, {"_id": 1}):
+            bloom.add(doc["_id"])
+        self.filter = bloom
+        self._synced_until = synced_until
+        print(f"Revocation filter loaded with {bloom.count} revoked refresh tokens")
+
+    async def sync(self):
+        """Add revocations made since the last sync (by any worker)"""
+        synced_until = datetime.utcnow()
+        since = self._synced_until - timedelta(seconds=REVOCATION_SYNC_OVERLAP_SECONDS)
+        cursor = self._db.revoked_tokens.find({"revoked_at": {"$gte": since}}, {"_id": 1})
+        async for doc in cursor:
+            self.filter.add(doc["_id"])
+        self._synced_until = synced_until
+
+        # A filter filled past capacity loses its error rate, start over
+        if self.filter.count > self.capacity:
+            await self.rebuild()
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_seconds)
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"Revocation filter sync failed: {e}")
+
+    async def revoke(self, db, payload: dict) -> bool:
+        """
+        Revoke a refresh token by its decoded payload
+
+        The insert is the atomic claim on the token: of several concurrent
+        calls for the same jti (on any worker) exactly one gets True.
+
+        Returns:
+            bool: False if the token was already revoked
+        """
+        jti = payload["jti"]
+        try:
+            await db.revoked_tokens.insert_one({
+                "_id": jti,
+                "revoked_at": datetime.utcnow(),
+                "expires_at": datetime.utcfromtimestamp(payload["exp"]),
+            })
+            claimed = True
+        except DuplicateKeyError:
+            metrics.inc("refresh_token_reuse")
+            claimed = False
+        self.filter.add(jti)
+        return claimed
+
+    async def is_revoked(self, db, jti: str) -> bool:
+        if jti not in self.filter:
+            metrics.inc("revocation_filter_negative")
+            return False
+        # Possible false positive, confirm against Mongo
+        metrics.inc("revocation_filter_lookup")
+        return await db.revoked_tokens.find_one({"_id": jti}, {"_id": 1}) is not None
+
+
+revocation_filter = RevocationFilter(
+    capacity=REVOCATION_FILTER_CAPACITY,
+    error_rate=REVOCATION_FILTER_ERROR_RATE,
+    sync_seconds=REVOCATION_SYNC_SECONDS,
+)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime, timedelta
 from datetime import date
 
@@ -64,7 +64,7 @@ class UserResponse(BaseModel):
     id: str = Field(..., description="User's unique identifier", example="507f1f77bcf86cd799439011")
     name: str = Field(..., description="User's full name", example= "John Doe")
     email: str = Field(..., description="User's email", example= "John@gmail.com")
-    created_at: str= Field(..., description="Account creation timestamp", example="2024-01-15T10:30:00")
+    created_at: datetime= Field(..., description="Account creation timestamp", example="2024-01-15T10:30:00")
 
     #fields for streak and reward points for front end display
     streak: int =0
@@ -74,17 +74,18 @@ class UserResponse(BaseModel):
 
     # NEW — Mode system
     mode: str ="casual" or "locked_in"
-    last_coding_date: Optional[str] = None
+    last_coding_date: Optional[date] = None
     missed_days: int = 0
     penalty_remaining: int = 0
-    weekly_reset_date: Optional[str] = None
+    weekly_reset_date: Optional[date] = None
 
     # Locked in session fields
     locked_in_active: bool = False
     locked_in_problems_required: int = 0
     locked_in_problems_completed: int = 0
-    locked_in_started_at: Optional[str] = None
+    locked_in_started_at: Optional[datetime] = None
     locked_in_time_limit: int = 0
+    locked_in_deadline: Optional[datetime] = None
 
 
 
@@ -107,7 +108,7 @@ class UserInDB(BaseModel):
     email: str
     hashed_password: Optional[str]
     provider: str = "manual"  #manual for user and google for google
-    created_at: str
+    created_at: datetime
 
     #new fields for xps and streaks
     streak: int = 0
@@ -117,17 +118,18 @@ class UserInDB(BaseModel):
 
     # NEW — Mode system
     mode: str = "casual"           # "casual" or "locked_in"
-    last_coding_date: Optional[str] = None
+    last_coding_date: Optional[date] = None
     missed_days: int = 0
     penalty_remaining: int = 0
-    weekly_reset_date: Optional[str] = None
+    weekly_reset_date: Optional[date] = None
 
     # Locked in session fields
     locked_in_active: bool = False
     locked_in_problems_required: int = 0
     locked_in_problems_completed: int = 0
-    locked_in_started_at: Optional[str] = None
+    locked_in_started_at: Optional[datetime] = None
     locked_in_time_limit: int = 0
+    locked_in_deadline: Optional[datetime] = None
 
 
     class Config:
@@ -139,6 +141,14 @@ class Token(BaseModel):
     """Schema for JWT token response"""
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+    # Post-login progress (filled by POST /auth/login)
+    name: Optional[str] = None
+    mode: Optional[str] = None
+    streak: Optional[int] = None
+    xp: Optional[int] = None
+    penalty_remaining: Optional[int] = None
 
 
     class Config:
@@ -151,6 +161,11 @@ class Token(BaseModel):
 
 
 
+class RefreshRequest(BaseModel):
+    """Schema for refreshing or revoking a session"""
+    refresh_token: str
+
+
 class TokenData(BaseModel):
     """Schema for token payload data"""
     email: Optional[str] = None
@@ -160,4 +175,10 @@ class ChatLog(BaseModel):
     user_id: str
     role: str  # "user" or "assistant"
     message: str
-    timestamp: datetime
\ No newline at end of file
+    timestamp: datetime
+
+
+class ChatHistoryPage(BaseModel):
+    """Schema for one page of keyset-paginated chat history"""
+    items: List[dict]
+    next_cursor: Optional[str] = None  # pass back as ?cursor= to get the next page
@@ -0,0 +1,208 @@
+"""
+Fails timed locked-in sessions when their time limit runs out
+
+A session started with time_limit > 0 (minutes) gets a locked_in_deadline.
+The scheduler keeps those deadlines in a min-heap and wakes up exactly at
+the earliest one, then fails every expired session with one bulk_write:
+the outstanding penalty comes off xp and the user drops back to casual,
+as with POST /lockedin/fail.
+"""
+
+import asyncio
+import heapq
+import os
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from metrics import metrics
+from user_cache import invalidate_user
+from user_repository import USER_PROGRESS, USERS, decode_timestamp
+
+load_dotenv()
+
+# Configuration
+LOCKED_IN_TIME_LIMIT_UNIT = timedelta(minutes=1)  # locked_in_time_limit is in minutes
+SESSION_EXPIRY_BATCH_SIZE = int(os.getenv("SESSION_EXPIRY_BATCH_SIZE", 500))
+# Pick up sessions started on other workers (0 = only at startup)
+SESSION_EXPIRY_RESYNC_SECONDS = float(os.getenv("SESSION_EXPIRY_RESYNC_SECONDS", 300))
+
+
+def session_deadline(started_at: datetime, time_limit: int) -> datetime | None:
+    """When a session started at started_at runs out, None if it has no limit"""
+    if not time_limit or time_limit <= 0:
+        return None
+    return started_at + time_limit * LOCKED_IN_TIME_LIMIT_UNIT
+
+
+def fail_session_stages() -> list:
+    """
+    Pipeline update ending a locked-in session as failed
+
+    Takes the outstanding penalty off xp (never below 0) and resets the
+    session, same outcome as POST /lockedin/fail.
+    """
+    return [{"$set": {
+        "xp": {"$max": [0, {"$subtract": [{"$ifNull": ["$xp", 0]}, {"$ifNull": ["$penalty_remaining", 0]}]}]},
+        "locked_in_active": False,
+        "mode": "casual",
+        "locked_in_problems_required": 0,
+        "locked_in_problems_completed": 0,
+        "locked_in_started_at": None,
+        "locked_in_time_limit": 0,
+        "locked_in_deadline": None,
+    }}]
+
+
+class SessionExpiryScheduler:
+    """
+    In-memory timer heap of (deadline, user_id)
+
+    Rebuilt at startup from an indexed query on (locked_in_active,
+    locked_in_deadline) and refreshed every SESSION_EXPIRY_RESYNC_SECONDS
+    for sessions started by other workers.
+
+    Heap entries are never removed when a session ends early: the fail
+    update is filtered on the session still being active with the same
+    deadline, so a stale entry (completed, failed or restarted session)
+    matches nothing. Several workers expiring the same session is just as
+    harmless.
+    """
+
+    def __init__(self, batch_size: int, resync_seconds: float):
+        self.batch_size = batch_size
+        self.resync_seconds = resync_seconds
+        self._heap: list[tuple[datetime, object]] = []
+        self._wake = asyncio.Event()
+        self._db = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self, db):
+        self._db = db
+        await self.rebuild()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def schedule(self, user_id, deadline: datetime | None):
+        """Track a session's deadline (called when a session starts)"""
+        if deadline is None:
+            return
+        heapq.heappush(self._heap, (deadline, user_id))
+        metrics.set_gauge("session_expiry_pending", len(self._heap))
+        if self._heap[0] == (deadline, user_id):
+            # New earliest deadline, re-arm the timer
+            self._wake.set()
+
+    async def rebuild(self):
+        """Reload deadlines of all active sessions"""
+        await self._backfill_deadlines()
+        heap = []
+        cursor = self._db[USER_PROGRESS].find(
+            {"locked_in_active": True, "locked_in_deadline": {"$ne": None}},
+            {"locked_in_deadline": 1},
+        )
+        async for doc in cursor:
+            heap.append((doc["locked_in_deadline"], doc["_id"]))
+        heapq.heapify(heap)
+        self._heap = heap
+        self._wake.set()
+        metrics.set_gauge("session_expiry_pending", len(heap))
+        print(f"Session expiry tracking {len(heap)} locked-in sessions")
+
+    async def _backfill_deadlines(self):
+        """Sessions started before deadlines were stored only have started_at + time_limit"""
+        cursor = self._db[USER_PROGRESS].find(
+            {"locked_in_active": True, "locked_in_time_limit": {"$gt": 0}, "locked_in_deadline": None},
+            {"locked_in_started_at": 1, "locked_in_time_limit": 1},
+        )
+        ops = []
+        async for doc in cursor:
+            started_at = decode_timestamp(doc.get("locked_in_started_at"))
+            if started_at is None:
+                continue
+            deadline = session_deadline(started_at, doc["locked_in_time_limit"])
+            ops.append(UpdateOne(
+                {"_id": doc["_id"], "locked_in_active": True, "locked_in_deadline": None},
+                {"$set": {"locked_in_deadline": deadline}},
+            ))
+        if ops:
+            await self._db[USER_PROGRESS].bulk_write(ops, ordered=False)
+
+    def _pop_expired(self, now: datetime) -> list:
+        expired = []
+        while self._heap and self._heap[0][0] <= now and len(expired) < self.batch_size:
+            expired.append(heapq.heappop(self._heap))
+        return expired
+
+    async def expire(self, expired: list) -> int:
+        """
+        Fail a batch of (deadline, user_id) sessions in one bulk_write
+
+        Returns:
+            int: Sessions actually failed (stale entries don't count)
+        """
+        started = time.perf_counter()
+        ops = [
+            UpdateOne(
+                {"_id": user_id, "locked_in_active": True, "locked_in_deadline": deadline},
+                fail_session_stages(),
+            )
+            for deadline, user_id in expired
+        ]
+        result = await self._db[USER_PROGRESS].bulk_write(ops, ordered=False)
+
+        # The user cache is keyed by email, which lives in users
+        cursor = self._db[USERS].find({"_id": {"$in": [user_id for _, user_id in expired]}}, {"email": 1})
+        async for user in cursor:
+            invalidate_user(user)
+
+        metrics.inc("session_expiry_failed", result.modified_count)
+        metrics.observe("session_expiry_batch_seconds", time.perf_counter() - started)
+        metrics.set_gauge("session_expiry_pending", len(self._heap))
+        return result.modified_count
+
+    def _seconds_until_next(self, now: datetime) -> float | None:
+        if not self._heap:
+            return None
+        return max(0.0, (self._heap[0][0] - now).total_seconds())
+
+    async def _loop(self):
+        last_resync = time.monotonic()
+        while True:
+            try:
+                if self.resync_seconds > 0 and time.monotonic() - last_resync >= self.resync_seconds:
+                    await self.rebuild()
+                    last_resync = time.monotonic()
+
+                expired = self._pop_expired(datetime.utcnow())
+                if expired:
+                    failed = await self.expire(expired)
+                    print(f"Expired {failed} locked-in sessions")
+                    continue
+
+                timeout = self._seconds_until_next(datetime.utcnow())
+                if self.resync_seconds > 0:
+                    remaining = self.resync_seconds - (time.monotonic() - last_resync)
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.inc("session_expiry_errors")
+                print(f"Session expiry failed: {e}")
+                await asyncio.sleep(1)
+
+
+session_expiry = SessionExpiryScheduler(
+    batch_size=SESSION_EXPIRY_BATCH_SIZE,
+    resync_seconds=SESSION_EXPIRY_RESYNC_SECONDS,
+)
@@ -1,13 +1,44 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from datetime import date, datetime, timedelta
+from datetime import date, timedelta
 from database import get_database
 from schemas import UserResponse
 from auth import get_current_user
+from user_repository import PROGRESS, find_user, find_and_update_user, encode_day, stored_day
 
 router= APIRouter(prefix="/streaks", tags=["Streak Tracking"])
 
 XP_PER_CHECKIN= 10
 
+
+def checkin_filter(today: date) -> dict:
+    """Matches users who haven't checked in today"""
+    return {"$expr": {"$or": [
+        {"$eq": [{"$ifNull": ["$last_active_date", None]}, None]},
+        {"$lt": [stored_day("last_active_date"), encode_day(today)]},
+    ]}}
+
+
+def checkin_update_stages(today: date) -> list:
+    """
+    Pipeline-update stages for one daily check-in
+
+    Streak +1 if the last check-in was yesterday, otherwise it restarts
+    at 1. Always paired with checkin_filter so a second check-in on the
+    same day matches nothing and changes nothing.
+    """
+    checked_in_yesterday = {"$and": [
+        {"$ne": [{"$ifNull": ["$last_active_date", None]}, None]},
+        {"$gte": [stored_day("last_active_date"), encode_day(today - timedelta(days=1))]},
+    ]}
+
+    return [{"$set": {
+        "streak": {"$cond": [checked_in_yesterday, {"$add": [{"$ifNull": ["$streak", 0]}, 1]}, 1]},
+        "xp": {"$add": [{"$ifNull": ["$xp", 0]}, XP_PER_CHECKIN]},
+        "total_checkins": {"$add": [{"$ifNull": ["$total_checkins", 0]}, 1]},
+        "last_active_date": encode_day(today),
+    }}]
+
+
 @router.post("/checkin", response_model= UserResponse)
 async def checkin(
     user: dict= Depends(get_current_user),
@@ -15,75 +46,32 @@ async def checkin(
     ):
     """Updates user streak, xp, and last_active_date."""
 
-    user_id= user["_id"]
     today= date.today()
 
-    #Fetch fresh records from DB
+    # One conditional write: streak/xp computed server-side, no-op if already checked in today,
+    # so retries and parallel tabs can't award XP twice
+    db_user = await find_and_update_user(
+        db, user,
+        checkin_update_stages(today),
+        PROGRESS,
+        query=checkin_filter(today)
+    )
 
-    db_user = await db.users.find_one({"_id": user_id})
+    if db_user is None:
+        # User already checked in today (nothing was written)
+        db_user = await find_user(db, user["_id"], PROGRESS)
 
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    last_active=  db_user.get("last_active_date")
-
-    
-    # Normalize last_active to a date or None
-    if last_active is None:
-        last_active_date = None
-    elif isinstance(last_active, str):
-        last_active_date = date.fromisoformat(last_active)
-    elif isinstance(last_active, datetime):
-        last_active_date = last_active.date()
-    elif isinstance(last_active, date):
-        last_active_date = last_active
-    else:
-        last_active_date = None
-    
-    streak = db_user.get("streak", 0)
-    xp= db_user.get("xp", 0)
-    total_checkins= db_user.get("total_checkins", 0)
-
-    #Streak logic
 
-    if last_active == today:
-        #User already checked in today
-        pass
-    else:
-        if last_active == today - timedelta(days=1):
-            # Increment streak normally
-            streak += 1
-        else:
-            # Streak broken
-            streak = 1
-
-        xp += XP_PER_CHECKIN
-        total_checkins += 1
-
-        # Update DB
-        await db.users.update_one(
-            {"_id": user_id},
-            {
-                "$set": {
-                    "streak": streak,
-                    "xp": xp,
-                    "total_checkins": total_checkins,
-                    "last_active_date": today.isoformat()
-                }
-            }
-        )
-    
     # Return updated user data
-    updated_user = await db.users.find_one({"_id": user_id})
-
     return UserResponse(
-        id=str(updated_user["_id"]),
-        name=updated_user["name"],
-        email=updated_user["email"],
-        created_at=updated_user["created_at"],
-        streak=updated_user["streak"],
-        xp=updated_user["xp"],
-        total_checkins=updated_user["total_checkins"],
-        last_active_date=updated_user.get("last_active_date")
+        id=str(db_user["_id"]),
+        name=db_user["name"],
+        email=db_user["email"],
+        created_at=db_user["created_at"],
+        streak=db_user["streak"],
+        xp=db_user["xp"],
+        total_checkins=db_user["total_checkins"],
+        last_active_date=db_user.get("last_active_date")
     )
-           
@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+import chat_storage
+from fake_db import FakeMongoClient
+
+START = datetime(2026, 1, 1)
+
+
+def message(user_id: str, i: int) -> dict:
+    return {"_id": ObjectId(), "user_id": user_id, "role": "user", "message": f"m{i}",
+            "timestamp": START + timedelta(minutes=i)}
+
+
+def bucket(user_id: str, messages: list) -> dict:
+    return {
+        "user_id": user_id,
+        "window": None,
+        "count": len(messages),
+        "start": min(m["timestamp"] for m in messages),
+        "end": max(m["timestamp"] for m in messages),
+        "messages": [chat_storage.to_bucket_message(m) for m in messages],
+    }
+
+
+async def read_all_pages(db, user_id: str, limit: int, newest_first: bool) -> list:
+    texts, cursor = [], None
+    while True:
+        items, cursor = await chat_storage.read_chat_history(db, user_id, limit, cursor, newest_first)
+        texts += [item["message"] for item in items]
+        if cursor is None:
+            return texts
+
+
+def test_pages_cover_overlapping_buckets(monkeypatch):
+    monkeypatch.setattr(chat_storage, "CHAT_LOG_STORAGE", "buckets")
+    db = FakeMongoClient()["test"]
+    messages = [message("u", i) for i in range(30)]
+
+    async def scenario():
+        # Interleaved buckets: every third message in one, the rest in another
+        await db.chat_log_buckets.insert_many([
+            bucket("u", messages[0::3]),
+            bucket("u", [m for i, m in enumerate(messages) if i % 3]),
+        ])
+        return (await read_all_pages(db, "u", 4, newest_first=True),
+                await read_all_pages(db, "u", 4, newest_first=False))
+
+    newest, oldest = asyncio.run(scenario())
+    assert newest == [f"m{i}" for i in reversed(range(30))]
+    assert oldest == [f"m{i}" for i in range(30)]
+
+
+def test_pages_after_cutover_migration(monkeypatch):
+    db = FakeMongoClient()["test"]
+    messages = [message("u", i) for i in range(30)]
+
+    async def scenario():
+        monkeypatch.setattr(chat_storage, "CHAT_LOG_STORAGE", "documents")
+        await chat_storage.insert_chat_logs(db, messages[:10])
+        monkeypatch.setattr(chat_storage, "CHAT_LOG_STORAGE", "buckets")
+        await chat_storage.insert_chat_logs(db, messages[10:13])
+        await chat_storage.migrate_to_buckets(db, delete_source=True)
+        for m in messages[13:]:
+            await chat_storage.insert_chat_logs(db, [m])
+        return await read_all_pages(db, "u", 5, newest_first=True)
+
+    assert asyncio.run(scenario()) == [f"m{i}" for i in reversed(range(30))]
+
+
+def test_live_appends_skip_migrated_buckets(monkeypatch):
+    from indexes import ensure_indexes, indexes_for
+
+    db = FakeMongoClient()["test"]
+    messages = [message("u", i) for i in range(8)]
+
+    async def scenario():
+        await ensure_indexes(db, indexes_for("chat_log_buckets"))
+        monkeypatch.setattr(chat_storage, "CHAT_LOG_STORAGE", "documents")
+        await chat_storage.insert_chat_logs(db, messages[:3])
+        monkeypatch.setattr(chat_storage, "CHAT_LOG_STORAGE", "buckets")
+        await chat_storage.migrate_to_buckets(db, delete_source=True)
+        for m in messages[3:]:
+            await chat_storage.insert_chat_logs(db, [m])
+        return await db.chat_log_buckets.find({}).sort("start", 1).to_list(length=None)
+
+    migrated, live = asyncio.run(scenario())
+    assert not migrated["open"] and [m["message"] for m in migrated["messages"]] == ["m0", "m1", "m2"]
+    assert live["open"] and live["count"] == 5
+
+
+def test_read_chat_logs_reads_through_the_archive(monkeypatch):
+    import chat_archive
+
+    monkeypatch.setattr(chat_storage, "CHAT_LOG_STORAGE", "documents")
+    db = FakeMongoClient()["test"]
+    messages = [message("u", i) for i in range(6)]
+
+    async def scenario():
+        await chat_storage.insert_chat_logs(db, messages)
+        # Archive everything older than m3
+        monkeypatch.setattr(chat_archive, "CHAT_HOT_RETENTION_DAYS", 0)
+        await chat_archive.compact_chat_logs(db, now=messages[3]["timestamp"])
+        assert await db.chat_logs.count_documents({}) == 3
+        return await chat_storage.read_chat_logs(db, "u", limit=5)
+
+    logs = asyncio.run(scenario())
+    assert [log["message"] for log in logs] == ["m0", "m1", "m2", "m3", "m4"]
+    assert all(log["user_id"] == "u" for log in logs)
@@ -0,0 +1,64 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+from metrics import metrics
+
+load_dotenv()
+
+# Configuration
+TOKEN_CACHE_MAX_SIZE = int(os.getenv("TOKEN_CACHE_MAX_SIZE", 10000))
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of already-verified JWTs -> decoded payload
+
+    Keyed by a SHA-256 of the token so raw bearer tokens are never kept
+    in memory. Entries are dropped once the token's own exp has passed,
+    so a cached token is never accepted for longer than jwt.decode would.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[bytes, tuple[float, dict]] = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> dict | None:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            metrics.inc("token_cache_miss")
+            return None
+
+        expires_at, payload = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            metrics.inc("token_cache_miss")
+            return None
+
+        self._entries.move_to_end(key)
+        metrics.inc("token_cache_hit")
+        # A copy, so a caller changing it can't alter what later requests see
+        return dict(payload)
+
+    def set(self, token: str, payload: dict):
+        exp = payload.get("exp")
+        if self.max_size <= 0 or exp is None:
+            # Tokens without exp never expire on their own, don't pin them
+            return
+        key = self._key(token)
+        self._entries[key] = (float(exp), payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+token_cache = VerifiedTokenCache(max_size=TOKEN_CACHE_MAX_SIZE)
@@ -0,0 +1,65 @@
+import os
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+from metrics import metrics
+
+load_dotenv()
+
+# Configuration
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", 30))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", 10000))
+
+
+class UserCache:
+    """
+    Per-process TTL cache of user documents keyed by token subject (email)
+
+    Anything in this codebase that writes a user document must call
+    invalidate() for that user, the TTL only bounds staleness from
+    writes made outside this process.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def get(self, email: str) -> dict | None:
+        entry = self._entries.get(email)
+        if entry is None:
+            metrics.inc("user_cache_miss")
+            return None
+
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del self._entries[email]
+            metrics.inc("user_cache_miss")
+            return None
+
+        self._entries.move_to_end(email)
+        metrics.inc("user_cache_hit")
+        # Copy so handlers can't mutate the cached entry
+        return dict(user)
+
+    def set(self, email: str, user: dict):
+        if self.ttl <= 0:
+            return
+        self._entries[email] = (time.monotonic() + self.ttl, dict(user))
+        self._entries.move_to_end(email)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, email: str):
+        self._entries.pop(email, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+user_cache = UserCache(ttl=USER_CACHE_TTL_SECONDS, max_size=USER_CACHE_MAX_SIZE)
+
+
+def invalidate_user(user: dict):
+    """Drop a user from the cache after writing their document"""
+    user_cache.invalidate(user["email"])
@@ -0,0 +1,478 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from datetime import date, datetime
+from typing import Optional, TypedDict
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from metrics import metrics
+from user_cache import invalidate_user
+
+
+# ============================================
+# TYPED VIEWS
+# ============================================
+
+class AuthUser(TypedDict, total=False):
+    _id: str
+    name: str
+    email: str
+    hashed_password: str
+    last_login_date: Optional[date]
+
+
+class ProfileUser(TypedDict, total=False):
+    _id: str
+    name: str
+    email: str
+    created_at: datetime
+    mode: str
+
+
+class ProgressUser(ProfileUser, total=False):
+    streak: int
+    xp: int
+    total_checkins: int
+    last_active_date: Optional[date]
+    last_login_date: Optional[date]
+    last_coding_date: Optional[date]
+    missed_days: int
+    penalty_remaining: int
+
+
+class LockedInUser(ProfileUser, total=False):
+    last_coding_date: Optional[date]
+    missed_days: int
+    penalty_remaining: int
+    weekly_reset_date: Optional[date]
+    locked_in_active: bool
+    locked_in_problems_required: int
+    locked_in_problems_completed: int
+    locked_in_started_at: Optional[datetime]
+    locked_in_time_limit: int
+    locked_in_evaluated_on: Optional[date]
+
+
+class ContextUser(ProgressUser, LockedInUser, total=False):
+    """Everything except credentials, what get_current_user hands to routes"""
+
+
+# ============================================
+# DATE CODECS
+# ============================================
+
+# Calendar days are stored as BSON dates at midnight UTC, timestamps as BSON dates.
+# Documents written before the migration (migrate_dates.py) still hold ISO strings,
+# so decoding accepts both.
+DAY_FIELDS = ("last_active_date", "last_login_date", "last_coding_date", "weekly_reset_date",
+              "locked_in_evaluated_on")
+TIMESTAMP_FIELDS = ("created_at", "locked_in_started_at", "locked_in_deadline")
+
+
+def encode_day(day: date | None) -> datetime | None:
+    """A calendar day as stored in Mongo (midnight UTC)"""
+    if day is None:
+        return None
+    return datetime(day.year, day.month, day.day)
+
+
+def decode_day(value) -> date | None:
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value[:10])
+
+
+def decode_timestamp(value) -> datetime | None:
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(value)
+
+
+def stored_day(field: str) -> dict:
+    """Aggregation expression reading a day field as a date, whether it's migrated or not"""
+    return {"$toDate": f"${field}"}
+
+
+def decode_dates(doc: dict) -> dict:
+    for field in DAY_FIELDS:
+        if field in doc:
+            doc[field] = decode_day(doc[field])
+    for field in TIMESTAMP_FIELDS:
+        if field in doc:
+            doc[field] = decode_timestamp(doc[field])
+    return doc
+
+
+# ============================================
+# STORAGE LAYOUT
+# ============================================
+
+# users holds the cold profile and credentials (name, email, hashed_password,
+# created_at), user_progress the small, frequently written progress document
+# with the same _id. mode lives with progress because the progress pipelines
+# (check-in, daily bonus, locked-in stages) branch on it.
+USERS = "users"
+USER_PROGRESS = "user_progress"
+
+HOT_FIELDS = frozenset({
+    "mode",
+    "streak",
+    "xp",
+    "total_checkins",
+    "last_active_date",
+    "last_login_date",
+    "last_login_xp",
+    "last_coding_date",
+    "missed_days",
+    "penalty_remaining",
+    "weekly_reset_date",
+    "locked_in_active",
+    "locked_in_problems_required",
+    "locked_in_problems_completed",
+    "locked_in_started_at",
+    "locked_in_time_limit",
+    "locked_in_deadline",
+    "locked_in_evaluated_on",
+})
+
+
+def _updated_fields(update) -> set:
+    """Top-level fields an update document or pipeline writes (scratch fields like _missed excluded)"""
+    paths = []
+    if isinstance(update, list):
+        for stage in update:
+            for name, spec in stage.items():
+                if name == "$unset":
+                    paths += [spec] if isinstance(spec, str) else list(spec)
+                else:
+                    paths += list(spec)
+    else:
+        for spec in update.values():
+            paths += list(spec)
+    return {path.split(".")[0] for path in paths if not path.startswith("_")}
+
+
+def _collection_for(update) -> str:
+    """
+    Which collection an update belongs to
+
+    Raises:
+        ValueError: If the update writes both progress and profile fields
+    """
+    fields = _updated_fields(update)
+    hot = fields & HOT_FIELDS
+    if hot and fields - HOT_FIELDS:
+        raise ValueError(f"Update mixes progress fields {sorted(hot)} with profile fields {sorted(fields - hot)}")
+    return USER_PROGRESS if hot else USERS
+
+
+def split_user_doc(user_doc: dict) -> tuple[dict, dict]:
+    """Split a full user document into its (users, user_progress) parts"""
+    cold = {k: v for k, v in user_doc.items() if k not in HOT_FIELDS}
+    hot = {"_id": user_doc["_id"], **{k: v for k, v in user_doc.items() if k in HOT_FIELDS}}
+    return cold, hot
+
+
+# ============================================
+# PROJECTIONS
+# ============================================
+
+class Projection:
+    """
+    A named set of user fields with their defaults
+
+    Reads only fetch these fields from Mongo (split between users and
+    user_progress); decode() fills in the defaults for fields missing on
+    older documents and turns stored dates into date / datetime objects.
+    """
+
+    def __init__(self, name: str, defaults: dict):
+        self.name = name
+        self.defaults = defaults
+        self.cold_fields = {"_id": 1, **{field: 1 for field in defaults if field not in HOT_FIELDS}}
+        hot = {field: 1 for field in defaults if field in HOT_FIELDS}
+        self.hot_fields = {"_id": 1, **hot} if hot else None
+
+    def decode(self, doc: dict | None) -> dict | None:
+        if doc is None:
+            return None
+        return decode_dates({**self.defaults, **doc})
+
+
+_PROFILE_DEFAULTS = {"name": None, "email": None, "created_at": None, "mode": "casual"}
+
+AUTH = Projection("auth", {"name": None, "email": None, "hashed_password": None})
+
+PROFILE = Projection("profile", _PROFILE_DEFAULTS)
+
+PROGRESS = Projection("progress", {
+    **_PROFILE_DEFAULTS,
+    "streak": 0,
+    "xp": 0,
+    "total_checkins": 0,
+    "last_active_date": None,
+    "last_login_date": None,
+    "last_login_xp": 0,
+    "last_coding_date": None,
+    "missed_days": 0,
+    "penalty_remaining": 0,
+})
+
+LOCKED_IN = Projection("locked_in", {
+    **_PROFILE_DEFAULTS,
+    "last_coding_date": None,
+    "missed_days": 0,
+    "penalty_remaining": 0,
+    "weekly_reset_date": None,
+    "locked_in_active": False,
+    "locked_in_problems_required": 0,
+    "locked_in_problems_completed": 0,
+    "locked_in_started_at": None,
+    "locked_in_time_limit": 0,
+    "locked_in_deadline": None,
+    "locked_in_evaluated_on": None,
+})
+
+CONTEXT = Projection("context", {**PROGRESS.defaults, **LOCKED_IN.defaults})
+
+# What a user_progress document starts from when created for an existing user
+PROGRESS_DEFAULTS = {field: value for field, value in CONTEXT.defaults.items() if field in HOT_FIELDS}
+
+
+# ============================================
+# READ-AFTER-WRITE TRACKING
+# ============================================
+
+# _ids written during the current request (each request runs in its own context)
+_written_ids: ContextVar[set | None] = ContextVar("written_user_ids", default=None)
+
+
+def _record_write(user_id):
+    written = _written_ids.get()
+    if written is None:
+        written = set()
+        _written_ids.set(written)
+    written.add(user_id)
+
+
+def _check_read_after_write(user_id, projection: "Projection"):
+    """Count reads of a user this request already wrote (find_and_update_user returns it instead)"""
+    written = _written_ids.get()
+    if written and user_id in written:
+        metrics.inc("users_read_after_write")
+        metrics.inc(f"users_read_after_write_{projection.name}")
+
+
+# ============================================
+# LAZY PROGRESS MIGRATION
+# ============================================
+
+async def _create_progress(db, user_id, projection: dict | None = None) -> dict | None:
+    """
+    Create the user_progress document of a user stored in the old layout
+
+    Copies the counters still embedded in users. $setOnInsert keeps this
+    harmless if another request (or migrate_progress.py) got there first.
+
+    Returns:
+        dict: The progress document, None if the user doesn't exist
+    """
+    legacy = await db[USERS].find_one({"_id": user_id}, {field: 1 for field in HOT_FIELDS})
+    if legacy is None:
+        return None
+    _, progress = split_user_doc({**PROGRESS_DEFAULTS, **legacy})
+    progress.pop("_id")
+    doc = await db[USER_PROGRESS].find_one_and_update(
+        {"_id": user_id},
+        {"$setOnInsert": progress},
+        projection=projection,
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    metrics.inc("user_progress_lazy_created")
+    return doc
+
+
+async def _progress_missing(db, user_id) -> bool:
+    """After a progress write matched nothing: create the document if that's why"""
+    if await db[USER_PROGRESS].find_one({"_id": user_id}, {"_id": 1}) is not None:
+        return False
+    return await _create_progress(db, user_id) is not None
+
+
+# ============================================
+# READS
+# ============================================
+
+async def _find_one(db, query: dict, projection: Projection) -> dict | None:
+    _check_read_after_write(query.get("_id"), projection)
+    started = time.perf_counter()
+
+    if projection.hot_fields is None:
+        cold, hot = await db[USERS].find_one(query, projection.cold_fields), {}
+    elif set(query) == {"_id"}:
+        # Both halves share the _id, fetch them side by side
+        cold, hot = await asyncio.gather(
+            db[USERS].find_one(query, projection.cold_fields),
+            db[USER_PROGRESS].find_one(query, projection.hot_fields),
+        )
+    else:
+        cold = await db[USERS].find_one(query, projection.cold_fields)
+        hot = await db[USER_PROGRESS].find_one({"_id": cold["_id"]}, projection.hot_fields) if cold else None
+
+    if cold is not None and hot is None:
+        hot = await _create_progress(db, cold["_id"], projection.hot_fields)
+
+    metrics.observe(f"users_read_{projection.name}_seconds", time.perf_counter() - started)
+    if cold is None:
+        return None
+    return projection.decode({**hot, **cold})
+
+
+async def find_user(db, user_id, projection: Projection) -> dict | None:
+    """
+    Read one user by _id, fetching only the projection's fields
+
+    Args:
+        db: Database instance
+        user_id: User's _id
+        projection: Which fields the caller needs (AUTH, PROFILE, PROGRESS, LOCKED_IN, CONTEXT)
+
+    Returns:
+        dict: Decoded user, or None if not found
+    """
+    return await _find_one(db, {"_id": user_id}, projection)
+
+
+async def find_user_by_email(db, email: str, projection: Projection) -> dict | None:
+    """Same as find_user, looked up by email (a user's _id is their email)"""
+    return await _find_one(db, {"_id": email}, projection)
+
+
+async def list_users(db, projection: Projection, limit: int) -> list:
+    docs = await db[USERS].find({}, projection.cold_fields).to_list(limit)
+    if projection.hot_fields and docs:
+        progress = await db[USER_PROGRESS].find(
+            {"_id": {"$in": [doc["_id"] for doc in docs]}}, projection.hot_fields
+        ).to_list(None)
+        by_id = {doc["_id"]: doc for doc in progress}
+        docs = [{**by_id.get(doc["_id"], {}), **doc} for doc in docs]
+    return [projection.decode(doc) for doc in docs]
+
+
+# ============================================
+# WRITES
+# ============================================
+
+async def insert_user(db, user_doc: dict):
+    """
+    Store a new user (profile in users, counters in user_progress)
+
+    Raises:
+        DuplicateKeyError: If the email is already registered
+    """
+    cold, hot = split_user_doc(user_doc)
+    progress = {k: v for k, v in hot.items() if k != "_id"}
+    started = time.perf_counter()
+    # users first: its unique email index is what rejects duplicates, and
+    # nothing may touch an existing user's progress before that check
+    await db[USERS].insert_one(cold)
+    try:
+        # Same $setOnInsert upsert as lazy creation: a leftover progress
+        # document (or a concurrent lazy creation) can't fail the registration
+        await db[USER_PROGRESS].update_one({"_id": user_doc["_id"]}, {"$setOnInsert": progress}, upsert=True)
+    except DuplicateKeyError:
+        pass  # concurrent upserts race to a duplicate key, the document exists either way
+    metrics.observe("users_write_seconds", time.perf_counter() - started)
+    _record_write(user_doc["_id"])
+
+
+async def update_user(db, user: dict, update, query: dict | None = None):
+    """
+    Apply an update to one user and drop them from the user cache
+
+    The update goes to users or user_progress depending on the fields it
+    writes; an update may not mix the two.
+
+    Args:
+        db: Database instance
+        user: The user being written (needs _id and email)
+        update: Update document or pipeline
+        query: Extra filter conditions on top of _id
+
+    Returns:
+        UpdateResult
+    """
+    collection = _collection_for(update)
+    started = time.perf_counter()
+    result = await db[collection].update_one({"_id": user["_id"], **(query or {})}, update)
+    if not result.matched_count and collection == USER_PROGRESS and await _progress_missing(db, user["_id"]):
+        result = await db[collection].update_one({"_id": user["_id"], **(query or {})}, update)
+    metrics.observe("users_write_seconds", time.perf_counter() - started)
+    if result.matched_count:
+        _record_write(user["_id"])
+    invalidate_user(user)
+    return result
+
+
+async def find_and_update_user(db, user: dict, update, projection: Projection,
+                               query: dict | None = None) -> dict | None:
+    """
+    Apply an update and return the post-update document in one round trip
+
+    Use this instead of update_user followed by find_user; reads of a user
+    already written in the same request show up as users_read_after_write.
+    Fields the projection needs from the other collection are read
+    alongside the write.
+
+    Args:
+        db: Database instance
+        user: The user being written (needs _id and email)
+        update: Update document or pipeline
+        projection: Fields to return from the updated document
+        query: Extra filter conditions on top of _id
+
+    Returns:
+        dict: Decoded user after the update, None if the filter didn't match
+    """
+    collection = _collection_for(update)
+    if collection == USER_PROGRESS:
+        fields, other, other_fields = projection.hot_fields or {"_id": 1}, USERS, projection.cold_fields
+    else:
+        fields, other, other_fields = projection.cold_fields, USER_PROGRESS, projection.hot_fields
+
+    async def write():
+        return await db[collection].find_one_and_update(
+            {"_id": user["_id"], **(query or {})},
+            update,
+            projection=fields,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def read_other():
+        if other_fields is None:
+            return {}
+        return await db[other].find_one({"_id": user["_id"]}, other_fields)
+
+    started = time.perf_counter()
+    doc, other_doc = await asyncio.gather(write(), read_other())
+    if doc is None and collection == USER_PROGRESS and await _progress_missing(db, user["_id"]):
+        doc = await write()
+    if other_doc is None and other == USER_PROGRESS:
+        other_doc = await _create_progress(db, user["_id"], other_fields)
+    metrics.observe("users_write_seconds", time.perf_counter() - started)
+    if doc is not None:
+        _record_write(user["_id"])
+    invalidate_user(user)
+
+    if doc is None or other_doc is None:
+        return None
+    return projection.decode({**doc, **other_doc})
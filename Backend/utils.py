@@ -2,10 +2,14 @@ from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from jose import jwt
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 from database import get_database
 from schemas import UserResponse
+from metrics import metrics
 
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
 
 
@@ -17,8 +21,26 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 
+# Claims mode: access tokens carry a small user snapshot so read-mostly routes skip the DB
+JWT_CLAIMS_MODE = os.getenv("JWT_CLAIMS_MODE", "false").lower() == "true"
+USER_CLAIMS_VERSION = 1  # bump when the snapshot shape changes, old tokens then fall back to the DB
+
+# bcrypt cost factor, pick it with `python calibrate_bcrypt.py` on the production host
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+
+# bcrypt runs on its own thread pool so it never blocks the event loop
+BCRYPT_MAX_WORKERS = int(os.getenv("BCRYPT_MAX_WORKERS", 2))
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", 32))  # running + queued before we shed load
+
 # Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min == max == BCRYPT_ROUNDS, so any hash made with another cost needs_update() and is rehashed on login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
@@ -33,6 +55,20 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """
+    Verify a password and rehash it if the stored hash is out of date
+    
+    Args:
+        plain_password: The plain text password
+        hashed_password: The hashed password from database
+        
+    Returns:
+        tuple: (matches, new_hash) where new_hash is None unless the stored
+               hash was made with outdated parameters
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def get_password_hash(password: str) -> str:
     """
     Hash a password using bcrypt
@@ -45,6 +81,78 @@ def get_password_hash(password: str) -> str:
     """
     return pwd_context.hash(password)
 
+# ============================================
+# NON-BLOCKING HASHING
+# ============================================
+
+class PasswordHashingBusy(Exception):
+    """Raised when too many bcrypt operations are already running or queued"""
+
+
+_bcrypt_executor = ThreadPoolExecutor(max_workers=BCRYPT_MAX_WORKERS, thread_name_prefix="bcrypt")
+_bcrypt_pending = 0
+
+
+async def _run_bcrypt(name: str, func, *args):
+    """
+    Run a bcrypt call on the dedicated executor
+
+    At most BCRYPT_MAX_WORKERS hashes run at once. Once BCRYPT_MAX_PENDING
+    calls are in flight new ones are rejected, so a login storm queues
+    on its own pool instead of starving every other route.
+
+    Raises:
+        PasswordHashingBusy: If the admission limit is reached
+    """
+    global _bcrypt_pending
+
+    if _bcrypt_pending >= BCRYPT_MAX_PENDING:
+        metrics.inc("bcrypt_rejected")
+        raise PasswordHashingBusy()
+
+    _bcrypt_pending += 1
+    metrics.set_gauge("bcrypt_pending", _bcrypt_pending)
+    submitted = time.perf_counter()
+
+    def timed():
+        started = time.perf_counter()
+        metrics.observe("bcrypt_queue_seconds", started - submitted)
+        result = func(*args)
+        metrics.observe(f"bcrypt_{name}_seconds", time.perf_counter() - started)
+        return result
+
+    def release():
+        global _bcrypt_pending
+        _bcrypt_pending -= 1
+        metrics.set_gauge("bcrypt_pending", _bcrypt_pending)
+
+    loop = asyncio.get_running_loop()
+    try:
+        future = _bcrypt_executor.submit(timed)
+    except BaseException:
+        release()
+        raise
+    # Released when the hash is actually done, not when the caller stops
+    # waiting: a cancelled request (client gone) leaves its hash running
+    future.add_done_callback(lambda _: loop.call_soon_threadsafe(release))
+    return await asyncio.wrap_future(future)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password without blocking the event loop"""
+    return await _run_bcrypt("verify", verify_password, plain_password, hashed_password)
+
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """verify_and_update_password without blocking the event loop"""
+    return await _run_bcrypt("verify", verify_and_update_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash without blocking the event loop"""
+    return await _run_bcrypt("hash", get_password_hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     Create a JWT access token
@@ -64,6 +172,30 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+def access_token_data(user: dict) -> dict:
+    """
+    Payload for a user's access token
+
+    Always carries the subject; in claims mode also a minimal, versioned
+    snapshot of the user (only fields that never change after signup).
+
+    Args:
+        user: User document
+
+    Returns:
+        dict: Data to pass to create_access_token
+    """
+    data = {"sub": user["email"]}
+    if JWT_CLAIMS_MODE:
+        data["usr"] = {
+            "v": USER_CLAIMS_VERSION,
+            "id": str(user["_id"]),
+            "name": user["name"],
+            "email": user["email"],
+        }
+    return data
+
+
 #function to reward xp points to user
 def add_xp (current_user: dict, xp_points: int, db, difficulty: str):
     xp_values = {